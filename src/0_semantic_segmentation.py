@@ -1,4 +1,3 @@
-import re
 import os
 import sys
 import argparse
@@ -8,7 +7,11 @@ from tqdm import tqdm
 import concurrent.futures
 path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(path)
-from llm import QWEN_LLM
+from llm import QWEN_LLM, add_llm_arguments, configure_llm, log_llm_stats, get_batch_client
+from utils.async_driver import run_stage_async
+from utils.llm_batch import run_stage_batch
+from utils.llm_metrics import track_question
+from utils.llm_response import parse_json_response, JSON_OBJECT_FORMAT
 
 # 设置日志配置
 logging.basicConfig(
@@ -50,80 +53,47 @@ Domain Knowledge: {domain_knowledge}
 Respond only with valid, parsable JSON.
 """ 
 
-def extract_json(message):
-    """
-    尝试从 LLM 返回中提取 JSON 对象：
-    1. 优先匹配 ```json { ... } ``` 代码块；
-    2. 如果没有，再找第一个 '{' 和最后一个 '}' 之间的内容；
-    3. 如果都失败，就原样返回。
-
-    并且：
-      - 如果提取到的字符串在闭合 '}' 前是 '";'，则把它替换为 '"}'
-      - 否则，若在闭合 '}' 前缺少 '"'，再自动补上一个
-    """
-    def _cleanup(json_str: str) -> str:
-        # —— 新增：如果闭合 } 前是 '";'，替换成 '"}'
-        json_str = re.sub(r'";\s*}$', '"}', json_str)
-
-        # —— 原有：补齐缺失的双引号
-        if not json_str.endswith('}'):
-            return json_str
-
-        # 跳过 '}' 之前所有空白，找到最后一个非空白字符
-        i = len(json_str) - 2
-        while i >= 0 and json_str[i].isspace():
-            i -= 1
+def build_segmentation_context(question, evidence):
+    return (
+        f'Question: "{question}"\n'
+        f'Domain Knowledge：\n{evidence}\n'
+    )
 
-        # 如果它不是 '"'，就在它后面插入一个
-        if i >= 0 and json_str[i] != '"':
-            insert_pos = i + 1
-            json_str = json_str[:insert_pos] + '"' + json_str[insert_pos:]
-
-        return json_str
-
-    # 1. 尝试 ```json … ``` 代码块
-    try:
-        match = re.search(r"```json\s*(\{.*?\})\s*```", message, re.DOTALL)
-        if match:
-            return _cleanup(match.group(1))
-    except Exception as e:
-        logging.error(f"Error extracting JSON with regex: {e}")
-
-    # 2. 尝试最简单的 { … } 截取
-    try:
-        start = message.find("{")
-        end   = message.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            candidate = message[start:end + 1]
-            return _cleanup(candidate)
-        else:
-            logging.warning("未找到有效 JSON 区间，直接返回原始消息")
-            return message
-    except Exception as e:
-        logging.error(f"Error extracting JSON using find: {e}")
-        return message
+def parse_segmentation(response):
+    print(response)
+    response_json = parse_json_response(response, name = "semantic_segmentation")
+    return response_json if response_json is not None else ""
 
 def semantic_segmentation(question, evidence):
     try:
-        context = (
-            f'Question: "{question}"\n'
-            f'Domain Knowledge：\n{evidence}\n'
-        )
+        context = build_segmentation_context(question, evidence)
         llm = QWEN_LLM()
-        response = llm(instruction, context)
-        response1 = extract_json(response)
-        response1.replace("\'", "'")
-        print(response1)
-        try:
-            response_json = json.loads(response1)
-            
-            return response_json
-        except json.JSONDecodeError as e:
-            logging.warning(f"semantic_segmentatio 无法解析 LLM 返回的 JSON: {e}, 返回空字符串" + f"\n{response}")
-            return ""
+        response = llm(instruction, context, response_format = JSON_OBJECT_FORMAT, call_site = "semantic_segmentation")
+        return parse_segmentation(response)
     except Exception as e:
         logging.error(f"semantic_segmentation 异常:{e}")
 
+def build_entity(ppl, semantic_segmentation_res):
+    semantic_segmentation_res_list = []
+    for key, values in semantic_segmentation_res.items():
+        if isinstance(values, list):
+            for value in values:
+                semantic_segmentation_res_list.append(value)
+        elif isinstance(values, str):
+            semantic_segmentation_res_list.append(values)
+    # print("semantic_segmentation_res_list:" + str(semantic_segmentation_res_list))
+    return {
+        "question_id": ppl['question_id'],
+        "db": ppl['db'],
+        "question": ppl['question'],
+        "evidence": ppl['evidence'],
+        "foreign_key": ppl['foreign_key'],
+        "semantic_seg_dict": semantic_segmentation_res,
+        "semantic_seg_list": semantic_segmentation_res_list,
+        "difficulty": ppl['difficulty']
+    }
+
+@track_question
 def process_item(ppl):
     try:
         question = ppl['question']
@@ -174,24 +144,7 @@ def process_item(ppl):
                     "return the k_symbol for the total debit amount of 3539"
                 ]
             }
-        semantic_segmentation_res_list = []
-        for key, values in semantic_segmentation_res.items():
-            if isinstance(values, list):
-                for value in values:
-                    semantic_segmentation_res_list.append(value)
-            elif isinstance(values, str):
-                semantic_segmentation_res_list.append(values)
-        # print("semantic_segmentation_res_list:" + str(semantic_segmentation_res_list))
-        entity = {
-            "question_id": ppl['question_id'],
-            "db": ppl['db'],
-            "question": ppl['question'],
-            "evidence": ppl['evidence'],
-            "foreign_key": ppl['foreign_key'],
-            "semantic_seg_dict": semantic_segmentation_res,
-            "semantic_seg_list": semantic_segmentation_res_list,
-            "difficulty": ppl['difficulty']
-        }
+        entity = build_entity(ppl, semantic_segmentation_res)
 
         return entity
     except KeyError as e:
@@ -200,6 +153,13 @@ def process_item(ppl):
         logging.error(f"处理 item 时异常: {e}")
     return None
 
+@track_question
+async def process_item_async(ppl):
+    """
+    与 process_item 相同的逻辑：基线中语义分割的 LLM 调用已注释掉，这里不发请求，异步模式的输出与默认模式一致
+    """
+    return process_item(ppl)
+
 def extract_error_json(input_file1, input_file2, output_file):
     # 从 file1 中读取所有 JSONL 记录，确保解析结果为 dict 类型
     items1 = []
@@ -231,7 +191,7 @@ def extract_error_json(input_file1, input_file2, output_file):
     with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(results, f, ensure_ascii=False, indent=4,
                       default=lambda o: list(o) if isinstance(o, set) else o) 
-def main(input_file, output_file, start_index, max_workers = 8):
+def main(input_file, output_file, start_index, max_workers = 8, use_async = False, concurrency = 128, batch_client = None):
     items = []
     with open(input_file, 'r', encoding='utf-8') as f:
         items = json.load(f)
@@ -239,21 +199,28 @@ def main(input_file, output_file, start_index, max_workers = 8):
     items_to_process = items[start_index:]
     logging.info(f"待处理条目数: {len(items_to_process)}")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
-         open(output_file, 'w', encoding='utf-8') as out_f:
-        futures = {executor.submit(process_item, it): it for it in items_to_process}
-        for future in tqdm(concurrent.futures.as_completed(futures),
-                           total=len(futures),
-                           desc="Processing items"):
-            try:
-                result = future.result()
-                if result:
-                    out_f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                    out_f.flush()
-            except Exception as e:
-                logging.error(f"处理并发任务时异常: {e}")
+    if use_async:
+        run_stage_async(items_to_process, process_item_async, output_file, concurrency)
+    elif batch_client is not None:
+        # 与默认模式相同的 process_item：基线不调用 LLM，批量模式第一轮即可全部完成
+        run_stage_batch(items_to_process, process_item, output_file, batch_client, max_workers)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+             open(output_file, 'w', encoding='utf-8') as out_f:
+            futures = {executor.submit(process_item, it): it for it in items_to_process}
+            for future in tqdm(concurrent.futures.as_completed(futures),
+                               total=len(futures),
+                               desc="Processing items"):
+                try:
+                    result = future.result()
+                    if result:
+                        out_f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        out_f.flush()
+                except Exception as e:
+                    logging.error(f"处理并发任务时异常: {e}")
 
     logging.info(f"已完成，结果保存在 {output_file}")
+    log_llm_stats()
 
 if __name__ == "__main__":
 
@@ -265,6 +232,9 @@ if __name__ == "__main__":
     parser.add_argument("--ppl_file1", type = str, default = "src/dataset/ppl_dev_null.json")
     parser.add_argument("--semantic_out_file", type = str, default = "src/dataset/qwen/coder-32b/semantic_seg.jsonl")
     parser.add_argument("--semantic_out_file1", type = str, default = "src/dataset/qwen/coder-32b/semantic_seg_null.jsonl")
+    add_llm_arguments(parser)
     args = parser.parse_args()
+    configure_llm(args)
+    batch_client = get_batch_client(args) if args.llm_batch else None
     # extract_error_json(args.ppl_file, args.semantic_out_file, args.ppl_file1)
-    main(args.ppl_file1, args.semantic_out_file1, args.start_index)
\ No newline at end of file
+    main(args.ppl_file1, args.semantic_out_file1, args.start_index, use_async = args.use_async, concurrency = args.concurrency, batch_client = batch_client)
\ No newline at end of file
@@ -4,14 +4,16 @@ import sys
 import copy
 import json
 import argparse
+import asyncio
 import concurrent.futures
 from tqdm import tqdm
 from instruction import SQL_GENERATION_INSTRUCTION1
 path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(path)
-from llm import QWEN_LLM_CODER, DP_LLM, GPT_LLM
+from llm import QWEN_LLM_CODER, DP_LLM, GPT_LLM, add_llm_arguments, configure_llm, log_llm_stats
 from utils.simplified_schema import simplified, explanation_collection, simplified_ddl1
 from utils import extract_tables_and_columns, get_all_schema
+from utils.async_driver import run_stage_async
 
 with open('src/dataset/ppl_dev.json', "r",  encoding="utf-8") as f:
     ppl_dev = json.load(f)
@@ -86,59 +88,6 @@ def prefect_foreign_key(tables, columns, foreign_key):
     
     return new_tables, new_columns
 
-def extract_json(message):
-    """
-    尝试从 LLM 返回中提取 JSON 对象：
-    1. 优先匹配 ```json { ... } ``` 代码块；
-    2. 如果没有，再找第一个 '{' 和最后一个 '}' 之间的内容；
-    3. 如果都失败，就原样返回。
-
-    并且：
-      - 如果提取到的字符串在闭合 '}' 前是 '";'，则把它替换为 '"}'
-      - 否则，若在闭合 '}' 前缺少 '"'，再自动补上一个
-    """
-    def _cleanup(json_str: str) -> str:
-        # —— 新增：如果闭合 } 前是 '";'，替换成 '"}'
-        json_str = re.sub(r'";\s*}$', '"}', json_str)
-
-        # —— 原有：补齐缺失的双引号
-        if not json_str.endswith('}'):
-            return json_str
-
-        # 跳过 '}' 之前所有空白，找到最后一个非空白字符
-        i = len(json_str) - 2
-        while i >= 0 and json_str[i].isspace():
-            i -= 1
-
-        # 如果它不是 '"'，就在它后面插入一个
-        if i >= 0 and json_str[i] != '"':
-            insert_pos = i + 1
-            json_str = json_str[:insert_pos] + '"' + json_str[insert_pos:]
-
-        return json_str
-
-    # 1. 尝试 ```json … ``` 代码块
-    try:
-        match = re.search(r"```json\s*(\{.*?\})\s*```", message, re.DOTALL)
-        if match:
-            return _cleanup(match.group(1))
-    except Exception as e:
-        print(f"Error extracting JSON with regex: {e}")
-
-    # 2. 尝试最简单的 { … } 截取
-    try:
-        start = message.find("{")
-        end   = message.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            candidate = message[start:end + 1]
-            return _cleanup(candidate)
-        else:
-            print("未找到有效 JSON 区间，直接返回原始消息")
-            return message
-    except Exception as e:
-        print(f"Error extracting JSON using find: {e}")
-        return message
-
 def generation_sql(schema, question, evidence, foreign_key, explanation):
     try:
         # table_info = (f'### Sqlite SQL tables, with their properties:\n{simplified_schema}\n'
@@ -198,9 +147,7 @@ def process_item(item):
         
         # 通过 LLM 抽取表和列信息
         # sql = "WITH TallestPlayers AS (    SELECT player_api_id, finishing    FROM Player p    JOIN Player_Attributes pa ON p.player_api_id = pa.player_api_id    WHERE height = (SELECT MAX(height) FROM Player)),ShortestPlayers AS (    SELECT player_api_id, finishing    FROM Player p    JOIN Player_Attributes pa ON p.player_api_id = pa.player_api_id    WHERE height = (SELECT MIN(height) FROM Player)), AverageFinishingRates AS (    SELECT 'Tallest' AS group_type, AVG(finishing) AS avg_finishing    FROM TallestPlayers    UNION ALL    SELECT 'Shortest' AS group_type, AVG(finishing) AS avg_finishing    FROM ShortestPlayers), MaxFinishingRateGroup AS (    SELECT group_type    FROM AverageFinishingRates    ORDER BY avg_finishing DESC    LIMIT 1)SELECT p.player_name FROM Player p JOIN Player_Attributes pa ON p.player_api_id = pa.player_api_id JOIN (    SELECT player_api_id    FROM TallestPlayers    WHERE (SELECT group_type FROM MaxFinishingRateGroup) = 'Tallest'    UNION ALL    SELECT player_api_id    FROM ShortestPlayers    WHERE (SELECT group_type FROM MaxFinishingRateGroup) = 'Shortest') AS MaxFinishingRatePlayers ON p.player_api_id = MaxFinishingRatePlayers.player_api_id ORDER BY pa.finishing DESCLIMIT 1"
-        sql = ""
-        while len(sql) == 0:
-            sql = generation_sql(simplified_schema, item['question'], item['evidence'], foreign_key, explanation)
+        sql = generation_sql(simplified_schema, item['question'], item['evidence'], foreign_key, explanation)
         print(sql)
         ans = extract_tables_and_columns(sql)
 
@@ -254,6 +201,11 @@ def process_item(item):
         print(f"Error processing item: {e}")
     return None
 
+async def process_item_async(item):
+    # 本阶段的 generation_sql 只构造 prompt、不请求 LLM，剩下的都是本地 schema 处理，
+    # 因此异步模式下直接放到默认线程池执行
+    return await asyncio.to_thread(process_item, item)
+
 def extract_error_json(input_file1, input_file2, output_file):
     # 从 file1 中读取所有 JSONL 记录，确保解析结果为 dict 类型
     items1 = []
@@ -286,7 +238,7 @@ def extract_error_json(input_file1, input_file2, output_file):
             json.dump(results, f, ensure_ascii=False, indent=4,
                       default=lambda o: list(o) if isinstance(o, set) else o)    
 
-def main(input_file, output_file, start_index, max_workers = 8):
+def main(input_file, output_file, start_index, max_workers = 8, use_async = False, concurrency = 128):
     try:
         with open(input_file, 'r', encoding='utf-8') as f:
             try:
@@ -303,18 +255,22 @@ def main(input_file, output_file, start_index, max_workers = 8):
 
     items_to_process = items[start_index:]
     
-    # 使用 ThreadPoolExecutor 实现多线程
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
-        open(output_file, 'w', encoding='utf-8') as f:
-        # 提交所有任务
-        futures = {executor.submit(process_item, item): item for item in items_to_process}
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Processing schema link from LLM"):
-            result = future.result()
-            if result is not None:
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                f.flush()
+    if use_async:
+        run_stage_async(items_to_process, process_item_async, output_file, concurrency)
+    else:
+        # 使用 ThreadPoolExecutor 实现多线程
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open(output_file, 'w', encoding='utf-8') as f:
+            # 提交所有任务
+            futures = {executor.submit(process_item, item): item for item in items_to_process}
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Processing schema link from LLM"):
+                result = future.result()
+                if result is not None:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    f.flush()
     print(reduce / 1534)
     print(f"Successfully saved results to {output_file}")
+    log_llm_stats()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -325,6 +281,8 @@ if __name__ == "__main__":
     parser.add_argument("--prompt_output_file", type=str, default="src/dataset/qwen/coder-32b/prompt_1.jsonl")
     parser.add_argument("--output_file1", type=str, default="src/dataset/qwen/coder-32b/1_sl_final_coder1_null.jsonl")
     parser.add_argument("--max_workers", type=int, default = 8, help="Number of worker threads")
+    add_llm_arguments(parser)
     args = parser.parse_args()
+    configure_llm(args)
     # extract_error_json(args.input_file, args.output_file, args.input_file1)
-    main(args.input_file, args.prompt_output_file, args.start_index, args.max_workers)
\ No newline at end of file
+    main(args.input_file, args.prompt_output_file, args.start_index, args.max_workers, args.use_async, args.concurrency)
\ No newline at end of file
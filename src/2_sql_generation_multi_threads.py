@@ -9,7 +9,11 @@ from instruction import SQL_GENERATION_INSTRUCTION
 
 path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(path)
-from llm import QWEN_LLM_CODER
+from llm import QWEN_LLM_CODER, AsyncQWEN_LLM, add_llm_arguments, configure_llm, log_llm_stats, get_batch_client
+from utils.async_driver import run_stage_async
+from utils.llm_batch import run_stage_batch
+from utils.llm_metrics import track_question
+from utils.llm_response import parse_sql_response
 
 instruction = """
 你是一个 SQL 查询生成助手，擅长将自然语言问题转化为高质量、可执行的 SQL 语句。请结合数据库结构信息、字段解释、样本数据等内容，完成以下任务。
@@ -49,60 +53,7 @@ instruction = """
 - 对日期、字符串等常量使用单引号。
 """
 
-def extract_json(message):
-    """
-    尝试从 LLM 返回中提取 JSON 对象：
-    1. 优先匹配 ```json { ... } ``` 代码块；
-    2. 如果没有，再找第一个 '{' 和最后一个 '}' 之间的内容；
-    3. 如果都失败，就原样返回。
-
-    并且：
-      - 如果提取到的字符串在闭合 '}' 前是 '";'，则把它替换为 '"}'
-      - 否则，若在闭合 '}' 前缺少 '"'，再自动补上一个
-    """
-    def _cleanup(json_str: str) -> str:
-        # —— 新增：如果闭合 } 前是 '";'，替换成 '"}'
-        json_str = re.sub(r'";\s*}$', '"}', json_str)
-
-        # —— 原有：补齐缺失的双引号
-        if not json_str.endswith('}'):
-            return json_str
-
-        # 跳过 '}' 之前所有空白，找到最后一个非空白字符
-        i = len(json_str) - 2
-        while i >= 0 and json_str[i].isspace():
-            i -= 1
-
-        # 如果它不是 '"'，就在它后面插入一个
-        if i >= 0 and json_str[i] != '"':
-            insert_pos = i + 1
-            json_str = json_str[:insert_pos] + '"' + json_str[insert_pos:]
-
-        return json_str
-
-    # 1. 尝试 ```json … ``` 代码块
-    try:
-        match = re.search(r"```json\s*(\{.*?\})\s*```", message, re.DOTALL)
-        if match:
-            return _cleanup(match.group(1))
-    except Exception as e:
-        print(f"Error extracting JSON with regex: {e}")
-
-    # 2. 尝试最简单的 { … } 截取
-    try:
-        start = message.find("{")
-        end   = message.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            candidate = message[start:end + 1]
-            return _cleanup(candidate)
-        else:
-            print("未找到有效 JSON 区间，直接返回原始消息")
-            return message
-    except Exception as e:
-        print(f"Error extracting JSON using find: {e}")
-        return message
-
-def generation_sql(question, schema, foreign_key, evidence, explanation, example, data):
+def build_generation_context(question, schema, foreign_key, evidence, explanation, example, data):
     # table_info = (
     #     f"Sqlite SQL 表及其属性：\n{schema}\n"
     #     f"Sqlite SQL 表的外键信息，用于表连接：\n{foreign_key}\n"
@@ -124,28 +75,37 @@ def generation_sql(question, schema, foreign_key, evidence, explanation, example
                   '\n#\n')
 
     context = "### example:\n" + "Question:"+ example.get('question') + "sql:" + example.get('sql') + "\n### Answer the question by sqlite SQL query only and with no explanation. You must minimize SQL execution time while ensuring correctness.\n" + table_info + '\n\n' + '### definition: ' + evidence + "\n### Question: " + question
+    return context
+
+def generation_sql(question, schema, foreign_key, evidence, explanation, example, data):
+    context = build_generation_context(question, schema, foreign_key, evidence, explanation, example, data)
 
     try:
         # example = json.loads(example)
         # instruction1 = instruction.format(question = example['question'], sql = example['sql'])
         llm = QWEN_LLM_CODER()
         print(context)
-        response = llm(SQL_GENERATION_INSTRUCTION, context)
-        response1 = extract_json(response)
-        # response1 = response1.replace("Women\'s Soccer", "Women''s Soccer")
-        # print(response1)
-        # return response1
-        try:
-            response_json = json.loads(response1)
-            return response_json.get("sql", "")
-            
-        except json.JSONDecodeError:
-            print("Warning: 无法解析 LLM 返回的 JSON，返回空字符串。")
-            return ""
+        response = llm(SQL_GENERATION_INSTRUCTION, context, answer_key = "sql", call_site = "generation_sql")
+        if response is None:
+            return None
+        return parse_sql_response(response, "generation_sql")
     except Exception as e:
         print(f"Error in generation_sql: {e}")
         return ""
 
+async def generation_sql_async(question, schema, foreign_key, evidence, explanation, example, data):
+    context = build_generation_context(question, schema, foreign_key, evidence, explanation, example, data)
+
+    try:
+        llm = AsyncQWEN_LLM()
+        response = await llm(SQL_GENERATION_INSTRUCTION, context, answer_key = "sql", call_site = "generation_sql")
+        if response is None:
+            return None
+        return parse_sql_response(response, "generation_sql")
+    except Exception as e:
+        print(f"Error in generation_sql_async: {e}")
+        return ""
+
 def extract_error_json(input_file1, input_file2, output_file):
     # 从 file1 中读取所有 JSONL 记录，确保解析结果为 dict 类型
     items1 = []
@@ -192,6 +152,24 @@ def extract_error_json(input_file1, input_file2, output_file):
             )
             f.write(json_line + '\n')  # 显式添加换行符
 
+def build_entity(item, sql):
+    return {
+        "question_id": item.get("question_id"),
+        "db": item.get("db"),
+        "question": item.get("question"),
+        "evidence": item.get("evidence"),
+        "columns": item.get("columns"),
+        "sql_1": item.get("sql_1"),
+        "sql_2": sql,
+        "schema": item.get("schema"),
+        "foreign_key": item.get("foreign_key"),
+        "explanation": item.get("explanation"),
+        "data": item.get("data"),
+        "example": item.get("explame"),
+        "difficulty": item.get("difficulty")
+    }
+
+@track_question
 def process_item(item):
     try:
         question = item.get("question")
@@ -204,9 +182,10 @@ def process_item(item):
         example = item.get("explame")
         data = item.get("data")
         
+        # 只在 LLM 请求本身失败（返回 None）时重试；解析失败重试也只会得到同样的回复
         attempts = 0
-        sql = ""
-        while sql == "" and attempts < 3:
+        sql = None
+        while sql is None and attempts < 3:
             sql = generation_sql(
                 question,
                 schema,
@@ -217,29 +196,38 @@ def process_item(item):
                 data
             )
             attempts += 1
-        
-        return {
-            "question_id": item.get("question_id"),
-            "db": db,
-            "question": question,
-            "evidence": evidence,
-            "columns": columns,
-            "sql_1": item.get("sql_1"),
-            "sql_2": sql,
-            "schema": schema,
-            "foreign_key": foreign_key,
-            "explanation": explanation,
-            "data": data,
-            "example": example,
-            "difficulty": item.get("difficulty")
-        }
+
+        return build_entity(item, sql or "")
     except KeyError as e:
         print(f"Warning: 缺少键 {e}，item={item}")
     except Exception as e:
         print(f"Error processing item: {e}")
     return None
 
-def main(input_file, output_file, start_index, max_workers = 8):
+@track_question
+async def process_item_async(item):
+    try:
+        # 只在 LLM 请求本身失败（返回 None）时重试；解析失败重试也只会得到同样的回复
+        attempts = 0
+        sql = None
+        while sql is None and attempts < 3:
+            sql = await generation_sql_async(
+                item.get("question"),
+                item.get("schema"),
+                item.get("foreign_key"),
+                item.get("evidence"),
+                item.get("explanation"),
+                item.get("explame"),
+                item.get("data")
+            )
+            attempts += 1
+
+        return build_entity(item, sql or "")
+    except Exception as e:
+        print(f"Error processing item: {e}")
+    return None
+
+def main(input_file, output_file, start_index, max_workers = 8, use_async = False, concurrency = 128, batch_client = None):
     # 按行读取 JSONL
     items = []
     with open(input_file, 'r', encoding='utf-8') as f:
@@ -254,19 +242,25 @@ def main(input_file, output_file, start_index, max_workers = 8):
 
     items_to_process = items[start_index:]
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
-         open(output_file, 'w', encoding='utf-8') as out_f:
-
-        futures = {executor.submit(process_item, it): it for it in items_to_process}
-        for future in tqdm(concurrent.futures.as_completed(futures),
-                           total=len(futures),
-                           desc="Processing items"):
-            result = future.result()
-            if result:
-                out_f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                out_f.flush()
+    if use_async:
+        run_stage_async(items_to_process, process_item_async, output_file, concurrency)
+    elif batch_client is not None:
+        run_stage_batch(items_to_process, process_item, output_file, batch_client, max_workers)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+             open(output_file, 'w', encoding='utf-8') as out_f:
+
+            futures = {executor.submit(process_item, it): it for it in items_to_process}
+            for future in tqdm(concurrent.futures.as_completed(futures),
+                               total=len(futures),
+                               desc="Processing items"):
+                result = future.result()
+                if result:
+                    out_f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out_f.flush()
 
     print(f"已完成，结果保存在 {output_file}")
+    log_llm_stats()
 
 
 if __name__ == "__main__":
@@ -279,7 +273,10 @@ if __name__ == "__main__":
     parser.add_argument("--input_file1", type = str, default = "src/dataset/qwen/coder-32b/en/1_5_normalize_schema_null.jsonl")
     parser.add_argument("--output_file1", type = str, default = "src/dataset/qwen/coder-32b/en/2_sql_generation1_null.jsonl")
     parser.add_argument("--max_workers", type=int, default = 8, help = "线程数")
+    add_llm_arguments(parser)
     args = parser.parse_args()
+    configure_llm(args)
+    batch_client = get_batch_client(args) if args.llm_batch else None
 
     # extract_error_json(args.input_file, args.output_file, args.input_file1)
-    main(args.input_file, args.output_file, args.start_index, args.max_workers)
\ No newline at end of file
+    main(args.input_file, args.output_file, args.start_index, args.max_workers, args.use_async, args.concurrency, batch_client)
\ No newline at end of file
@@ -3,6 +3,7 @@ import re
 import sys
 import json
 import argparse
+import asyncio
 import logging
 from tqdm import tqdm
 import concurrent.futures
@@ -10,8 +11,19 @@ from instruction import COT_SYNTHESIZE_SQL_INSTRUCTION
 
 path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(path)
-from llm import QWEN_LLM_CODER
-from utils.util import execute_sql
+from llm import QWEN_LLM_CODER, add_llm_arguments, configure_llm, log_llm_stats, get_batch_client
+from utils.util import execute_sql_detail
+from utils.db_pool import log_db_pool_stats
+from utils.exec_cache import enable_exec_cache, log_exec_cache_stats
+from utils.sql_executor import enable_sql_executor, log_sql_executor_stats
+from utils.db_replica import enable_db_replicas, log_db_replica_stats
+from utils.sql_cost import enable_cost_gate, log_cost_gate_stats
+from utils.sql_canonical import enable_sql_dedup, get_sql_dedup, log_sql_dedup_stats, dedup_call, dedupe_candidates
+from utils.result_shortcut import enable_result_shortcut, get_result_shortcut, log_result_shortcut_stats
+from utils.async_driver import run_stage_async
+from utils.llm_batch import run_stage_batch
+from utils.llm_metrics import track_question
+from utils.llm_response import parse_sql_response
 
 # 设置日志配置
 logging.basicConfig(
@@ -58,62 +70,15 @@ instruction = """
 - 输出必须遵循 JSON 格式，只返回 SQL 查询语句，禁止附加任何解释或推理过程。
 """
 
-def extract_json(message):
-    """
-    尝试从 LLM 返回中提取 JSON 对象：
-    1. 优先匹配 ```json { ... } ``` 代码块；
-    2. 如果没有，再找第一个 '{' 和最后一个 '}' 之间的内容；
-    3. 如果都失败，就原样返回。
-
-    并且：
-      - 如果提取到的字符串在闭合 '}' 前是 '";'，则把它替换为 '"}'
-      - 否则，若在闭合 '}' 前缺少 '"'，再自动补上一个
-    """
-    def _cleanup(json_str: str) -> str:
-        # —— 新增：如果闭合 } 前是 '";'，替换成 '"}'
-        json_str = re.sub(r'";\s*}$', '"}', json_str)
-
-        # —— 原有：补齐缺失的双引号
-        if not json_str.endswith('}'):
-            return json_str
-
-        # 跳过 '}' 之前所有空白，找到最后一个非空白字符
-        i = len(json_str) - 2
-        while i >= 0 and json_str[i].isspace():
-            i -= 1
-
-        # 如果它不是 '"'，就在它后面插入一个
-        if i >= 0 and json_str[i] != '"':
-            insert_pos = i + 1
-            json_str = json_str[:insert_pos] + '"' + json_str[insert_pos:]
-
-        return json_str
-
-    # 1. 尝试 ```json … ``` 代码块
-    try:
-        match = re.search(r"```json\s*(\{.*?\})\s*```", message, re.DOTALL)
-        if match:
-            return _cleanup(match.group(1))
-    except Exception as e:
-        logging.error(f"Error extracting JSON with regex: {e}")
-
-    # 2. 尝试最简单的 { … } 截取
-    try:
-        start = message.find("{")
-        end   = message.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            candidate = message[start:end + 1]
-            return _cleanup(candidate)
-        else:
-            logging.warning("未找到有效 JSON 区间，直接返回原始消息")
-            return message
-    except Exception as e:
-        logging.error(f"Error extracting JSON using find: {e}")
-        return message
-
 def execute_single_sql(db_name, sql):
+    # 规范化后相同的 SQL 只执行一次，返回时换回调用方的写法
+    result = dedup_call(("exec", db_name), sql, lambda: run_single_sql(db_name, sql))
+    return dict(result, sql = sql)
+
+def run_single_sql(db_name, sql):
     try:
-        row_count, column_count, result_preview, exec_time = execute_sql(sql, db_name)
+        detail = execute_sql_detail(sql, db_name)
+        row_count, column_count, result_preview, exec_time = detail["row_count"], detail["column_count"], detail["result"], detail["exec_time"]
     except Exception as e:
         logging.error(f"SQL 执行异常，数据库: {db_name}, SQL: {sql}. 错误: {e}")
         return {
@@ -139,10 +104,11 @@ def execute_single_sql(db_name, sql):
             "column_count": column_count,
             "result_preview": result_preview,
             "exec_time": exec_time,
-            "result": result_preview
+            "result": result_preview,
+            "fingerprint": detail["fingerprint"]
         }
 
-def cot_synthesize_sql(question, schema, foreign_key, evidence, explanation, data, sql, result):
+def build_synthesize_context(question, schema, foreign_key, evidence, explanation, data, sql, result):
     table_info = ('### Sqlite SQL tables, with their properties:\n' + schema +
                   '\n### Here are some data information about database references.\n' + data +
                   '\n### Foreign key information of Sqlite SQL tables, used for table joins:\n' + foreign_key +
@@ -178,21 +144,47 @@ def cot_synthesize_sql(question, schema, foreign_key, evidence, explanation, dat
         '\n### List of current SQL queries and their execution results:\n' + sql_result
     )
     
+    return context
+
+def parse_synthesize_response(response):
+    logging.info("语义对齐 LLM 返回: " + response)
+    return parse_sql_response(response, "cot_synthesize_sql")
+
+def agreed_sql(sql, result):
+    # 候选执行结果一致时直接采用，不再调用 LLM
+    shortcut = get_result_shortcut()
+    return shortcut.pick(sql, result) if shortcut is not None else None
+
+def cot_synthesize_sql(question, schema, foreign_key, evidence, explanation, data, sql, result):
+    agreed = agreed_sql(sql, result)
+    if agreed is not None:
+        return agreed
+    context = build_synthesize_context(question, schema, foreign_key, evidence, explanation, data, sql, result)
     try:
         llm = QWEN_LLM_CODER()
-        response = llm(COT_SYNTHESIZE_SQL_INSTRUCTION, context)
-        logging.info("语义对齐 LLM 返回: " + response)
-        response1 = extract_json(response)
-        try:
-            response_json = json.loads(response1)
-            return response_json.get("sql", "")
-        except json.JSONDecodeError as e:
-            logging.warning(f"无法解析 LLM 返回的 JSON: {e}, 返回空字符串" + f"\n{response1}")
-            return ""
+        response = llm(COT_SYNTHESIZE_SQL_INSTRUCTION, context, answer_key = "sql", call_site = "cot_synthesize_sql")
+        return parse_synthesize_response(response)
     except Exception as e:
         logging.error(f"semantic_alignment 调用 LLM 异常: {e}")
         return ""
 
+def build_entity(item, sql_3):
+    return {
+        "question_id": item.get("question_id"),
+        "db": item.get("db"),
+        "question": item.get("question"),
+        "sql_1": item.get("sql_1"),
+        "sql_2": item.get("sql_2"),
+        "sql_3": sql_3,
+        "evidence": item.get("evidence"),
+        "schema": item.get("schema"),
+        "foreign_key": item.get("foreign_key"),
+        "explanation": item.get("explanation"),
+        "data": item.get("data"),
+        "difficulty": item.get("difficulty")
+    }
+
+@track_question
 def process_item(item):
     try:
         db = item.get("db")
@@ -205,28 +197,15 @@ def process_item(item):
         sql_1 = item.get("sql_1")
         sql_2 = item.get("sql_2")
 
-        result1 = execute_single_sql(db, sql_1)
-        result2 = execute_single_sql(db, sql_2)
-
         sql = [sql_1, sql_2]
-        result = [result1, result2]
+        if get_sql_dedup() is not None:
+            # 两条候选规范化后相同时只保留一条交给 LLM
+            sql = dedupe_candidates(sql)
+        result = [execute_single_sql(db, s) for s in sql]
 
         sql_3 = cot_synthesize_sql(question, schema, foreign_key, evidence, explanation, data, sql, result)
         
-        entity = {
-            "question_id": item.get("question_id"),
-            "db": db,
-            "question": question,
-            "sql_1": sql_1,
-            "sql_2": sql_2,
-            "sql_3": sql_3,
-            "evidence": evidence,
-            "schema": schema,
-            "foreign_key": foreign_key,
-            "explanation": explanation,
-            "data": data,
-            "difficulty": item.get("difficulty")
-        }
+        entity = build_entity(item, sql_3)
         return entity
     except KeyError as e:
         logging.warning(f"缺少键 {e}，item={item}")
@@ -234,7 +213,12 @@ def process_item(item):
         logging.error(f"处理 item 时异常: {e}")
     return None
 
-def main(input_file, output_file, start_index, max_workers=8):
+@track_question
+async def process_item_async(item):
+    # 与同步模式共用 process_item：SQL 执行与 LLM 调用都在线程中进行，并发数由 run_stage_async 的信号量控制
+    return await asyncio.to_thread(process_item, item)
+
+def main(input_file, output_file, start_index, max_workers=8, use_async=False, concurrency=128, batch_client=None):
     items = []
     try:
         with open(input_file, 'r', encoding='utf-8') as f:
@@ -253,21 +237,34 @@ def main(input_file, output_file, start_index, max_workers=8):
     items_to_process = items[start_index:]
     logging.info(f"待处理条目数: {len(items_to_process)}")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
-         open(output_file, 'w', encoding='utf-8') as out_f:
-        futures = {executor.submit(process_item, it): it for it in items_to_process}
-        for future in tqdm(concurrent.futures.as_completed(futures),
-                           total=len(futures),
-                           desc="Processing items"):
-            try:
-                result = future.result()
-                if result:
-                    out_f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                    out_f.flush()
-            except Exception as e:
-                logging.error(f"处理并发任务时异常: {e}")
+    if use_async:
+        run_stage_async(items_to_process, process_item_async, output_file, concurrency)
+    elif batch_client is not None:
+        run_stage_batch(items_to_process, process_item, output_file, batch_client, max_workers)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor, \
+             open(output_file, 'w', encoding='utf-8') as out_f:
+            futures = {executor.submit(process_item, it): it for it in items_to_process}
+            for future in tqdm(concurrent.futures.as_completed(futures),
+                               total=len(futures),
+                               desc="Processing items"):
+                try:
+                    result = future.result()
+                    if result:
+                        out_f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        out_f.flush()
+                except Exception as e:
+                    logging.error(f"处理并发任务时异常: {e}")
 
     logging.info(f"已完成，结果保存在 {output_file}")
+    log_llm_stats()
+    log_db_pool_stats()
+    log_exec_cache_stats()
+    log_sql_executor_stats()
+    log_db_replica_stats()
+    log_cost_gate_stats()
+    log_sql_dedup_stats()
+    log_result_shortcut_stats()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -275,6 +272,28 @@ if __name__ == "__main__":
     parser.add_argument("--input_file", type = str, default = "src/dataset/qwen/coder-32b/en/2_sql_generation1.jsonl")
     parser.add_argument("--output_file", type = str, default = "src/dataset/qwen/coder-32b/en/3_cot_synthesize_sql1.jsonl")
     parser.add_argument("--max_workers", type = int, default = 8, help = "线程数")
+    parser.add_argument("--exec_cache", action = "store_true", help = "启用 SQL 执行结果磁盘缓存")
+    parser.add_argument("--sql_workers", type = int, default = 0, help = "沙箱 SQL worker 进程数，0 表示在线程内直接执行")
+    parser.add_argument("--db_replicas", type = str, default = "", help = "加载副本的数据库：逗号分隔的库名 / all / top:N")
+    parser.add_argument("--db_replica_mode", type = str, default = "memory", choices = ["memory", "mmap"])
+    parser.add_argument("--cost_gate", action = "store_true", help = "执行前用 EXPLAIN QUERY PLAN 估算代价，拒绝或缩短超时")
+    parser.add_argument("--sql_dedup", action = "store_true", help = "规范化后相同的 SQL 只执行、判断一次")
+    parser.add_argument("--result_shortcut", action = "store_true", help = "候选 SQL 执行结果一致时不调用 LLM")
+    add_llm_arguments(parser)
     args = parser.parse_args()
-
-    main(args.input_file, args.output_file, args.start_index, args.max_workers)
\ No newline at end of file
+    configure_llm(args)
+    if args.exec_cache:
+        enable_exec_cache()
+    if args.db_replicas:
+        enable_db_replicas(args.db_replicas, args.db_replica_mode)
+    if args.cost_gate:
+        enable_cost_gate()
+    if args.sql_dedup:
+        enable_sql_dedup()
+    if args.result_shortcut:
+        enable_result_shortcut()
+    if args.sql_workers > 0:
+        enable_sql_executor(args.sql_workers)
+    batch_client = get_batch_client(args) if args.llm_batch else None
+
+    main(args.input_file, args.output_file, args.start_index, args.max_workers, args.use_async, args.concurrency, batch_client)
\ No newline at end of file
@@ -1,11 +1,15 @@
 import json
 from tqdm import tqdm
-from utils.util import execute_sql
+from utils.util import execute_sql_detail
+from utils.result_shortcut import enable_result_shortcut
 from utils.simplified_schema import simplified, explanation_collection
 import argparse
 
 
-def prompt_construct(simple_ddl, ddl_data, foreign_key, explanation, ppl, sql1, sql2):
+def prompt_construct(simple_ddl, ddl_data, foreign_key, explanation, ppl, sql1, sql2, details=None):
+    """
+    details: 两条候选已有的 execute_sql_detail 结果，缺省时在这里执行
+    """
     db = ppl['db']
     question = ppl['question'].strip()
     evidence = ppl['evidence'].strip()
@@ -16,8 +20,9 @@ def prompt_construct(simple_ddl, ddl_data, foreign_key, explanation, ppl, sql1,
 
     table_info = example.strip() + '\n\n' + "### Answer the question by sqlite SQL query only and with no explanation. You must minimize SQL execution time while ensuring correctness.\n" + table_info.strip() + '\n\n' + '### definition: ' + evidence + "\n### Question: " + question
 
-    r1, c1, re1 = execute_sql(sql1, db)
-    r2, c2, re2 = execute_sql(sql2, db)
+    if details is None:
+        details = [execute_sql_detail(sql1, db), execute_sql_detail(sql2, db)]
+    re1, re2 = details[0]["result"], details[1]["result"]
 
     candidate_sql = f"### sql1: {sql1} \n### result1: {re1} \n### sql2: {sql2} \n### result2: {re2}"
 
@@ -36,7 +41,7 @@ def sql_generation(table_info, candidate_sql):
     return answer
 
 
-def main(ppl_file, output_file, sql_file1, sql_file2, x=0):
+def main(ppl_file, output_file, sql_file1, sql_file2, x=0, result_shortcut=False):
     # 1.加载prompt信息 从0开始
     with open(ppl_file, 'r') as f:
         ppls = json.load(f)
@@ -48,19 +53,34 @@ def main(ppl_file, output_file, sql_file1, sql_file2, x=0):
         sqls2s = f.readlines()
 
     answers = []
+    shortcut = enable_result_shortcut() if result_shortcut else None
 
     for i in tqdm(range(x, len(ppls))):
         ppl = ppls[i]
         sql1 = sqls1s[i].strip()
         sql2 = sqls2s[i].strip()
 
+        # 两条候选执行结果一致时直接采用，不调用 LLM
+        agreed = None
+        details = None
+        if shortcut is not None:
+            details = [execute_sql_detail(sql1, ppl['db']), execute_sql_detail(sql2, ppl['db'])]
+            agreed = shortcut.pick([sql1, sql2], details)
+        if agreed is not None:
+            answers.append(agreed)
+            with open(output_file, 'w', encoding='utf-8') as file:
+                for sql in answers:
+                    file.write(str(sql) + '\n')
+            continue
+
         # 简化ddl
         simple_ddl, ddl_data, foreign_key = simplified(ppl)
 
         # 列描述
         explanation = explanation_collection(ppl)
 
-        table_info, candidate_sql = prompt_construct(simple_ddl, ddl_data, foreign_key, explanation, ppl, sql1, sql2)
+        # 候选结果不一致时复用上面的执行结果构造 prompt，不再重复执行
+        table_info, candidate_sql = prompt_construct(simple_ddl, ddl_data, foreign_key, explanation, ppl, sql1, sql2, details)
 
         # 3.4. thought_gpt
         sql = sql_generation(table_info, candidate_sql)
@@ -71,6 +91,9 @@ def main(ppl_file, output_file, sql_file1, sql_file2, x=0):
             for sql in answers:
                 file.write(str(sql) + '\n')
 
+    if shortcut is not None:
+        print(f"结果一致捷径统计: {shortcut.stats()}")
+
 
 if __name__ == '__main__':
     # 创建 ArgumentParser 对象
@@ -83,8 +106,9 @@ if __name__ == '__main__':
     parser.add_argument("--sql_3_output", type=str, default="src/sql_log/step_3_binary.txt")
     parser.add_argument("--sql_1", type=str, default="src/sql_log/preliminary_sql.txt")
     parser.add_argument("--sql_2", type=str, default="src/sql_log/step_2_information_augmentation.txt")
+    parser.add_argument("--result_shortcut", action="store_true", help="两条候选执行结果一致时不调用 LLM")
 
     # 解析命令行参数
     args = parser.parse_args()
 
-    main(args.ppl_file, args.sql_3_output, args.sql_1, args.sql_2, args.start_index)
+    main(args.ppl_file, args.sql_3_output, args.sql_1, args.sql_2, args.start_index, args.result_shortcut)
@@ -5,4 +5,102 @@ class DEV:
 class QWEN:
     model = 'qwen2.5-coder-32b-instruct' # qwen\
     api = ''
-    base_url = 'ttps://dashscope.aliyuncs.com/compatible-mode/v1'
\ No newline at end of file
+    base_url = 'ttps://dashscope.aliyuncs.com/compatible-mode/v1'
+
+class LLM_CACHE:
+    path = 'cache/llm_cache.sqlite'
+    max_bytes = 2 * 1024 * 1024 * 1024  # 缓存文件上限 2GB，超出后按 LRU 淘汰
+
+class LLM_ASYNC:
+    concurrency = 128  # 异步驱动下同时在途的 LLM 请求数上限
+
+class LLM_THROTTLE:
+    initial_limit = 8       # 初始允许的在途请求数
+    min_limit = 1
+    max_limit = 256
+    decrease_factor = 0.5   # 遇到 429/5xx 时的乘性收缩系数
+    latency_tolerance = 3.0 # 平滑延迟超过基线的倍数时视为拥塞
+    latency_window = 200    # 延迟基线取最近多少次成功请求的平滑延迟最小值
+    max_retries = 5
+    backoff_base = 1.0      # 指数退避基数（秒）
+    backoff_cap = 60.0      # 单次退避上限（秒）
+
+class LLM_CLIENT:
+    pool_size = 8            # 连接池大小，默认与阶段线程数一致
+    http2 = True             # 安装了 h2 时启用 HTTP/2
+    keepalive_expiry = 60.0  # 空闲 keep-alive 连接保留时间（秒）
+    timeout = 120.0
+
+class LLM_BATCH:
+    workdir = 'cache/batch'     # batch 输入 / 输出 JSONL 的存放目录
+    poll_interval = 30.0        # 轮询 batch 状态的间隔（秒）
+    completion_window = '24h'
+    max_rounds = 10             # 多轮调用的阶段最多提交的 batch 轮数
+
+class LLM_BACKEND:
+    name = 'openai'                                 # openai / record / replay
+    recording_path = 'cache/llm_recording.jsonl'    # record 写入、replay 读取的录制文件
+    replay_latency = 'none'                         # none / recorded / fixed:秒 / uniform:a,b / lognormal:mu,sigma
+    seed = 0
+
+class LLM_HEDGE:
+    percentile = 0.95       # 耗时超过最近延迟的该分位数时发出对冲请求
+    window = 500            # 参与计算分位数的最近延迟样本数
+    min_samples = 50        # 样本不足时不对冲
+    min_delay = 1.0         # 对冲阈值下限（秒）
+    max_hedge_rate = 0.1    # 对冲请求占总调用数的上限
+
+class LLM_METRICS:
+    path = 'cache/llm_metrics.jsonl'
+    prompt_price = 0.002      # 输入单价（元 / 千 token），按 qwen2.5-coder-32b-instruct 计
+    completion_price = 0.006  # 输出单价（元 / 千 token）
+
+class DB_POOL:
+    max_idle_per_db = 16        # 每个数据库保留的空闲连接数上限
+    cache_size_kb = 64 * 1024   # 每个连接的页缓存（KB）
+    mmap_size = 256 * 1024 * 1024
+    immutable = True            # 以 immutable=1 打开，数据库在运行期间不能被修改
+    progress_steps = 1000       # 每执行多少条 VM 指令检查一次超时
+
+class EXEC_CACHE:
+    path = 'cache/exec_cache.sqlite'
+
+class EXEC_STREAM:
+    fetch_size = 1000                   # 每次 fetchmany 的行数
+    max_rows = 1000000                  # 单条 SQL 最多读取的行数，超出后截断
+    max_bytes = 256 * 1024 * 1024       # 单条 SQL 最多读取的数据量（估计值）
+
+class SQL_EXECUTOR:
+    num_workers = 8                         # 沙箱 worker 进程数
+    memory_limit = 4 * 1024 * 1024 * 1024   # 每个 worker 在启动时的地址空间之外可新增的内存（RLIMIT_AS）
+    cpu_limit = 90                          # 单条 SQL 可消耗的 CPU 秒数（RLIMIT_CPU）
+    grace = 5.0                             # worker 超过 timeout 多少秒仍未返回时强制杀掉
+
+class DB_REPLICA:
+    mode = 'memory'                             # memory：backup 到内存；mmap：整文件 mmap 并预读
+    max_total_bytes = 8 * 1024 * 1024 * 1024    # 所有副本的总大小上限
+
+class SQL_COST:
+    stats_path = 'cache/table_stats.json'   # 各库每张表的行数统计
+    warn_cost = 1e8         # 估算访问行数超过该值时缩短超时
+    reject_cost = 1e11      # 超过该值直接拒绝执行
+    tight_timeout = 10      # 缩短后的超时（秒）
+    default_rows = 1000     # 子查询 / CTE 等行数未知时的默认值
+
+class DB_INDEX:
+    indexed_databases_path = 'database/dev_databases_indexed'  # 建好索引的数据库副本，目录结构与 dev_databases 相同
+    report_path = 'cache/index_report.jsonl'
+    min_support = 2             # 同一索引至少被多少条 SQL 用到才创建
+    max_covering_columns = 4    # 覆盖索引最多包含的列数，超出时只索引谓词列
+    max_indexes_per_table = 5
+    timeout = 30                # 对比前后耗时时单条 SQL 的超时（秒）
+    runs = 3                    # 每条 SQL 执行次数，取最短耗时
+
+class SQL_DEDUP:
+    max_entries = 100000    # 执行结果与修复判断记忆表的条目上限
+
+class GOLD_CACHE:
+    path = 'cache/gold_results.sqlite'  # 评测用 gold SQL 结果指纹，按数据库快照与规范化 SQL 存储
+
+class EVAL_STORE:
+    path = 'cache/eval_store.sqlite'    # 逐题评测结果，key = (question_id, 预测 SQL 哈希, 数据库快照)
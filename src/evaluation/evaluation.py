@@ -1,12 +1,25 @@
+import os
 import sys
 import json
+import time
 import argparse
 import sqlite3
 import multiprocessing as mp
+import statistics
+import functools
+from urllib.request import pathname2url
 from func_timeout import func_timeout, FunctionTimedOut
 from tqdm import tqdm  # 导入 tqdm
 import math
 
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(path)
+from utils.exec_cache import enable_exec_cache, get_exec_cache, stream_entry, make_error_entry
+from utils.gold_cache import enable_gold_cache, get_gold_cache
+from utils.db_pool import sql_deadline
+from utils.eval_store import EvalStore
+from config import EVAL_STORE, EXEC_STREAM
+
 # 全局变量，存放多进程返回结果和进度条对象
 exec_result = []
 pbar = None  # 用于进度条更新
@@ -45,34 +58,95 @@ def result_callback(result):
 # SQL 执行相关函数
 # ----------------------------
 
+def cached_entry(cursor, sql, db_path, cache):
+    """
+    查询执行结果缓存，未命中时执行并写入（cache 为 None 时只执行）；返回缓存条目，
+    命中缓存时带 cached=True，其 exec_time 是当初执行时的耗时而不是本次测得的
+    """
+    entry = cache.get(db_path, sql) if cache is not None else None
+    if entry is not None:
+        entry = dict(entry, cached = True)
+    # 流水线中因字节上限被截断的结果没有指纹，评测时只按行数上限重新执行；超过行数上限的结果重跑也没有指纹
+    if entry is None or (entry["error"] is None and entry["fingerprint"] is None
+                         and entry["row_count"] < EXEC_STREAM.max_rows):
+        start_time = time.time()
+        try:
+            cursor.execute(sql)
+            entry = stream_entry(cursor, start_time, max_rows = EXEC_STREAM.max_rows, max_bytes = None)
+        except sqlite3.OperationalError as e:
+            # 被 sql_deadline 中止的查询是超时而不是 SQL 错误，不能写入缓存
+            if str(e) == "interrupted":
+                raise
+            entry = make_error_entry(str(e), time.time() - start_time)
+        except sqlite3.Error as e:
+            entry = make_error_entry(str(e), time.time() - start_time)
+        if cache is not None:
+            cache.put(db_path, sql, entry)
+    return entry
+
+def cached_fingerprint(cursor, sql, db_path, cache):
+    """
+    SQL 报错时抛出与直接执行相同的异常类型
+    """
+    entry = cached_entry(cursor, sql, db_path, cache)
+    if entry["error"] is not None:
+        raise sqlite3.OperationalError(entry["error"])
+    return entry["fingerprint"]
+
 def execute_sql(predicted_sql, ground_truth, db_path):
     """
     在指定的 SQLite 数据库中执行预测 SQL 和真实 SQL，并比较结果
     """
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
     try:
-        cursor.execute(predicted_sql)
-        predicted_res = cursor.fetchall()
-        cursor.execute(ground_truth)
-        ground_truth_res = cursor.fetchall()
+        return compare_sql(conn, predicted_sql, ground_truth, db_path)
     finally:
         conn.close()
+
+def compare_sql(conn, predicted_sql, ground_truth, db_path):
+    cursor = conn.cursor()
+    if get_exec_cache() is not None or get_gold_cache() is not None:
+        # 指纹与 set 比较等价，命中缓存的一侧不再执行；gold 优先查预先算好的 gold 缓存
+        predicted_fp = cached_fingerprint(cursor, predicted_sql, db_path, get_exec_cache())
+        ground_truth_fp = cached_fingerprint(cursor, ground_truth, db_path, get_gold_cache() or get_exec_cache())
+        # 超过行数上限的一侧没有指纹，退回完整的 set 比较
+        if predicted_fp is not None and ground_truth_fp is not None:
+            return 1 if predicted_fp == ground_truth_fp else 0
+    return compare_sets(cursor, predicted_sql, ground_truth)
+
+def compare_sets(cursor, predicted_sql, ground_truth):
+    cursor.execute(predicted_sql)
+    predicted_res = cursor.fetchall()
+    cursor.execute(ground_truth)
+    ground_truth_res = cursor.fetchall()
     return 1 if set(predicted_res) == set(ground_truth_res) else 0
 
+def is_transient_error(e):
+    """
+    与 SQL 本身无关、重跑可能成功的异常（锁冲突、I/O 错误、被中止、内存不足等）；SQL 写错等确定性错误不算
+    """
+    if isinstance(e, sqlite3.OperationalError):
+        message = str(e).lower()
+        return any(m in message for m in ("locked", "busy", "interrupted", "disk i/o", "unable to open", "out of memory"))
+    return not isinstance(e, sqlite3.Error)
+
 def execute_model(predicted_sql, ground_truth, db_place, idx, meta_time_out):
     """
-    单个 SQL 查询对执行模型，带超时保护
+    单个 SQL 查询对执行模型，带超时保护；transient 表示结果来自临时性故障，不能当作确定的评测结果保存
     """
+    timed_out = False
+    transient = False
     try:
         res = func_timeout(meta_time_out, execute_sql, args=(predicted_sql, ground_truth, db_place))
     except KeyboardInterrupt:
         sys.exit(0)
     except FunctionTimedOut:
         res = 0
+        timed_out = True
     except Exception as e:
         res = 0
-    result = {'sql_idx': idx, 'res': res}
+        transient = is_transient_error(e)
+    result = {'sql_idx': idx, 'res': res, 'timed_out': timed_out, 'transient': transient}
     return result
 
 # ----------------------------
@@ -150,6 +224,343 @@ def run_sqls_parallel(sqls, db_places, num_cpus=1, meta_time_out=30.0):
     # 任务结束后关闭进度条
     pbar.close()
 
+def compute_gold(task):
+    """
+    预计算一条 gold SQL 的结果指纹并写入 gold 缓存；task 为 (gold SQL, db_path, 超时)，返回 cached / computed / error / timeout
+    """
+    ground_truth, db_path, meta_time_out = task
+    if not os.path.exists(db_path):
+        return "error"
+    cache = get_gold_cache()
+    entry = cache.get(db_path, ground_truth)
+    if entry is not None:
+        return "cached"
+    start_time = time.time()
+    conn = sqlite3.connect(db_path)
+    state = {"expired": False}
+    try:
+        # 用 progress_handler 中止超时的 gold，超时与否取决于本次预算，不写入缓存
+        with sql_deadline(conn, meta_time_out) as state:
+            cursor = conn.execute(ground_truth)
+            entry = stream_entry(cursor, start_time, max_rows = EXEC_STREAM.max_rows, max_bytes = None)
+    except sqlite3.Error as e:
+        if state["expired"]:
+            return "timeout"
+        entry = make_error_entry(str(e), time.time() - start_time)
+    finally:
+        conn.close()
+    cache.put(db_path, ground_truth, entry)
+    return "computed" if entry["error"] is None else "error"
+
+def precompute_gold(gt_queries, gt_db_paths, num_cpus=1, meta_time_out=30.0):
+    """
+    每个数据库快照只需执行一次全部 gold SQL，之后的评测直接比较指纹
+    """
+    tasks = sorted({(sql, gt_db_paths[qid]) for qid, sql in gt_queries.items()}, key=lambda x: x[1])
+    pool = mp.Pool(processes=num_cpus)
+    statuses = []
+    with tqdm(total=len(tasks), desc="预计算 gold SQL", ncols=100) as bar:
+        for status in pool.imap_unordered(compute_gold, [(sql, db_path, meta_time_out) for sql, db_path in tasks], chunksize=8):
+            statuses.append(status)
+            bar.update(1)
+    pool.close()
+    pool.join()
+    counts = {s: statuses.count(s) for s in sorted(set(statuses))}
+    print(f"gold SQL 预计算完成: {counts}")
+
+# ----------------------------
+# 常驻 worker 进程池
+# ----------------------------
+
+# worker 进程内按 db_path 缓存的只读连接，同一个库的任务复用连接，页缓存保持温热
+worker_connections = {}
+
+def get_worker_connection(db_path):
+    conn = worker_connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+        worker_connections[db_path] = conn
+    return conn
+
+def execute_model_pooled(predicted_sql, ground_truth, db_place, idx, meta_time_out):
+    """
+    在 worker 缓存的连接上比较一对 SQL，超时由 progress_handler 中止查询，不再额外起线程
+    """
+    state = {"expired": False}
+    transient = False
+    try:
+        conn = get_worker_connection(db_place)
+        with sql_deadline(conn, meta_time_out) as state:
+            res = compare_sql(conn, predicted_sql, ground_truth, db_place)
+    except Exception as e:
+        res = 0
+        transient = is_transient_error(e)
+    return {'sql_idx': idx, 'res': res, 'timed_out': state["expired"], 'transient': transient}
+
+def evaluate_chunk(chunk, meta_time_out):
+    return [execute_model_pooled(predicted_sql, ground_truth, db_place, idx, meta_time_out)
+            for idx, predicted_sql, ground_truth, db_place in chunk]
+
+def iter_results_pooled(sqls, db_places, num_cpus=1, meta_time_out=30.0, chunk_size=16):
+    """
+    按数据库分组切块分发给常驻 worker，结果按 sql_idx 顺序逐条 yield
+    """
+    tasks = sorted(((i, predicted_sql, ground_truth, db_places[i]) for i, (predicted_sql, ground_truth) in enumerate(sqls)),
+                   key=lambda task: task[3])
+    chunks = []
+    for task in tasks:
+        if chunks and chunks[-1][-1][3] == task[3] and len(chunks[-1]) < chunk_size:
+            chunks[-1].append(task)
+        else:
+            chunks.append([task])
+
+    pending = {}
+    next_idx = 0
+    with mp.Pool(processes=num_cpus) as pool:
+        for results in pool.imap_unordered(functools.partial(evaluate_chunk, meta_time_out=meta_time_out), chunks):
+            for result in results:
+                pending[result['sql_idx']] = result
+            while next_idx in pending:
+                yield pending.pop(next_idx)
+                next_idx += 1
+
+def run_sqls_pooled(sqls, db_places, num_cpus=1, meta_time_out=30.0, chunk_size=16):
+    global exec_result
+    exec_result = []
+    for result in tqdm(iter_results_pooled(sqls, db_places, num_cpus, meta_time_out, chunk_size),
+                       total=len(sqls), desc="执行 SQL 查询", ncols=100):
+        exec_result.append(result)
+
+# ----------------------------
+# 多列评测：一次评测 JSONL 中所有 sql_* 字段
+# ----------------------------
+
+def column_order(column):
+    # sql_1 ... sql_6 按数字排序，sql_final 排在最后
+    suffix = column[4:]
+    return (0, int(suffix), "") if suffix.isdigit() else (1, 0, suffix)
+
+def package_all_columns(sql_path):
+    """
+    返回 {question_id: {列名: 预测 SQL}}，只收集字符串类型的 sql_* 字段
+    """
+    predictions = {}
+    for item in load_json_lines(sql_path):
+        columns = {k: v for k, v in item.items() if k.startswith("sql_") and isinstance(v, str)}
+        if columns:
+            predictions[item['question_id']] = columns
+    return predictions
+
+def timed_entry(conn, sql, db_path, cache, meta_time_out):
+    """
+    带超时的 cached_entry，超时返回 None
+    """
+    state = {"expired": False}
+    try:
+        with sql_deadline(conn, meta_time_out) as state:
+            return cached_entry(conn.cursor(), sql, db_path, cache)
+    except sqlite3.OperationalError as e:
+        if state["expired"]:
+            return None
+        return make_error_entry(str(e), 0)
+
+def timed_compare(conn, predicted_sql, ground_truth, meta_time_out):
+    """
+    带超时的 compare_sets，返回 (是否正确, 是否超时)
+    """
+    state = {"expired": False}
+    try:
+        with sql_deadline(conn, meta_time_out) as state:
+            return compare_sets(conn.cursor(), predicted_sql, ground_truth) == 1, False
+    except sqlite3.Error:
+        return False, state["expired"]
+
+def evaluate_question(task):
+    """
+    task 为 (question_id, 去重后的预测 SQL 列表, gold SQL, db_path, 超时)；gold 只执行一次，
+    返回 (question_id, {预测 SQL: {"res", "exec_time", "timed_out", "cached"}})；
+    命中执行缓存的预测不计时，exec_time 为 None、cached 为 True，耗时统计只含本次实际执行的 SQL
+    """
+    question_id, predictions, ground_truth, db_place, meta_time_out = task
+    failed = {sql: {'res': 0, 'exec_time': None, 'timed_out': False, 'cached': False} for sql in predictions}
+    try:
+        conn = get_worker_connection(db_place)
+    except sqlite3.Error:
+        return question_id, failed
+    gold = timed_entry(conn, ground_truth, db_place, get_gold_cache() or get_exec_cache(), meta_time_out)
+    gold_ok = gold is not None and gold["error"] is None
+    results = {}
+    for sql in predictions:
+        entry = timed_entry(conn, sql, db_place, get_exec_cache(), meta_time_out)
+        if entry is None:
+            results[sql] = {'res': 0, 'exec_time': None, 'timed_out': True, 'cached': False}
+            continue
+        timed_out = False
+        if gold_ok and entry["error"] is None and (entry["fingerprint"] is None or gold["fingerprint"] is None):
+            # 超过行数上限的结果没有指纹，退回完整的 set 比较
+            correct, timed_out = timed_compare(conn, sql, ground_truth, meta_time_out)
+        else:
+            correct = gold_ok and entry["error"] is None and entry["fingerprint"] == gold["fingerprint"]
+        cached = entry.get("cached", False)
+        results[sql] = {
+            'res': 1 if correct else 0,
+            'exec_time': entry["exec_time"] if entry["error"] is None and not cached else None,
+            'timed_out': timed_out,
+            'cached': cached,
+        }
+    return question_id, results
+
+def evaluate_all_columns(sql_path, gt_queries, gt_db_paths, num_cpus=1, meta_time_out=30.0):
+    """
+    返回 {列名: {question_id: 单题结果}}；同一道题中写法完全相同的预测只执行一次
+    """
+    predictions = package_all_columns(sql_path)
+    tasks = []
+    total = 0
+    for question_id, columns in predictions.items():
+        if question_id not in gt_queries:
+            continue
+        unique = sorted({sql.strip() for sql in columns.values()})
+        total += len(columns)
+        tasks.append((question_id, unique, gt_queries[question_id], gt_db_paths[question_id], meta_time_out))
+    tasks.sort(key=lambda task: task[3])
+    print(f"多列评测: {len(tasks)} 道题，{total} 条预测，去重后执行 {sum(len(t[1]) for t in tasks)} 条")
+
+    question_results = {}
+    with mp.Pool(processes=num_cpus) as pool:
+        for question_id, results in tqdm(pool.imap_unordered(evaluate_question, tasks, chunksize=4),
+                                         total=len(tasks), desc="多列评测", ncols=100):
+            question_results[question_id] = results
+
+    matrix = {}
+    for question_id, results in question_results.items():
+        for column, sql in predictions[question_id].items():
+            matrix.setdefault(column, {})[question_id] = results[sql.strip()]
+    return dict(sorted(matrix.items(), key=lambda x: column_order(x[0])))
+
+def print_matrix(matrix, difficulty_dict):
+    levels = ['simple', 'moderate', 'challenging', 'total']
+    print("{:12} {:>8} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12} {:>9} {:>9}".format(
+        "column", "count", *levels, "mean_time", "p95_time", "timeouts", "cached"))
+    for column, results in matrix.items():
+        accs = []
+        for level in levels:
+            scores = [r['res'] for qid, r in results.items() if level == 'total' or difficulty_dict.get(qid, 'simple') == level]
+            accs.append(sum(scores) / len(scores) * 100 if scores else 0)
+        times = sorted(r['exec_time'] for r in results.values() if r['exec_time'] is not None)
+        mean_time = statistics.mean(times) if times else 0
+        p95_time = times[min(len(times) - 1, int(len(times) * 0.95))] if times else 0
+        timeouts = sum(1 for r in results.values() if r['timed_out'])
+        # 命中执行缓存的预测没有本次的耗时，不计入 mean_time / p95_time
+        cached = sum(1 for r in results.values() if r['cached'])
+        print("{:12} {:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f} {:>11.3f}s {:>11.3f}s {:>9} {:>9}".format(
+            column, len(results), *accs, mean_time, p95_time, timeouts, cached))
+
+# ----------------------------
+# VES 计时相关函数
+# ----------------------------
+
+def pin_worker(counter):
+    """
+    进程池初始化：每个 worker 绑定到一个独立的 CPU 核，计时互不干扰
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+
+def clean_abnormal(times):
+    """
+    去掉偏离均值 3 个标准差以外的计时
+    """
+    if len(times) < 2:
+        return times
+    mean, std = statistics.mean(times), statistics.pstdev(times)
+    kept = [t for t in times if mean - 3 * std <= t <= mean + 3 * std]
+    return kept or times
+
+def time_sql(conn, sql, runs, meta_time_out):
+    """
+    每次执行（含预热）各有一个 meta_time_out 的时限，计时次数多不会挤占单次执行的预算
+    """
+    cursor = conn.cursor()
+    times = []
+    # 第 0 次为预热，之后的计时都在温热的页缓存上进行
+    for run in range(runs + 1):
+        with sql_deadline(conn, meta_time_out):
+            start_time = time.perf_counter()
+            cursor.execute(sql)
+            while cursor.fetchmany(1000):
+                pass
+            if run > 0:
+                times.append(time.perf_counter() - start_time)
+    return statistics.mean(clean_abnormal(times))
+
+def execute_model_ves(predicted_sql, ground_truth, db_place, idx, meta_time_out, runs):
+    """
+    结果正确时分别对预测 SQL 与 gold SQL 计时 runs 次，time_ratio = gold 耗时 / 预测耗时；结果错误或超时为 0
+    """
+    result = execute_model(predicted_sql, ground_truth, db_place, idx, meta_time_out)
+    result['time_ratio'] = 0
+    if result['res'] != 1:
+        return result
+    conn = get_worker_connection(db_place)
+    try:
+        predicted_time = time_sql(conn, predicted_sql, runs, meta_time_out)
+        ground_truth_time = time_sql(conn, ground_truth, runs, meta_time_out)
+        if predicted_time > 0:
+            result['time_ratio'] = ground_truth_time / predicted_time
+    except sqlite3.Error:
+        pass
+    return result
+
+def run_ves_parallel(sqls, db_places, num_cpus=1, meta_time_out=30.0, runs=10):
+    """
+    每个 worker 绑定一个核、同一时刻只执行一条 SQL；worker 数不超过可用核数
+    """
+    global pbar, exec_result
+    if hasattr(os, 'sched_getaffinity'):
+        num_cpus = min(num_cpus, len(os.sched_getaffinity(0)))
+    counter = mp.Value('i', 0)
+    pool = mp.Pool(processes=num_cpus, initializer=pin_worker, initargs=(counter,))
+    exec_result = []
+
+    pbar = tqdm(total=len(sqls), desc="VES 计时", ncols=100)
+    for i, sql_pair in enumerate(sqls):
+        predicted_sql, ground_truth = sql_pair
+        pool.apply_async(execute_model_ves, args=(predicted_sql, ground_truth, db_places[i], i, meta_time_out, runs), callback=result_callback)
+    pool.close()
+    pool.join()
+    pbar.close()
+
+def run_incremental(store, question_ids, sqls, db_places, run_engine):
+    """
+    只执行评测库中没有记录的题，其余直接取历史结果；返回按 sql_idx 排好序的全部结果。
+    超时与临时性故障（锁冲突、I/O 错误等）的结果不写入评测库，下次增量评测会重新执行
+    """
+    results = []
+    pending = []
+    for i, (predicted_sql, ground_truth) in enumerate(sqls):
+        res = store.get(question_ids[i], predicted_sql, ground_truth, db_places[i])
+        if res is None:
+            pending.append(i)
+        else:
+            results.append({'sql_idx': i, 'res': res})
+    print(f"增量评测: {len(sqls) - len(pending)} 题复用历史结果，{len(pending)} 题需要执行")
+
+    rows = []
+    if pending:
+        for result in run_engine([sqls[i] for i in pending], [db_places[i] for i in pending]):
+            i = pending[result['sql_idx']]
+            results.append(dict(result, sql_idx=i))
+            if not result.get('timed_out') and not result.get('transient'):
+                rows.append((question_ids[i], sqls[i][0], sqls[i][1], db_places[i], result['res']))
+    store.put_many(rows)
+    return sort_results(results)
+
 def sort_results(list_of_dicts):
     return sorted(list_of_dicts, key=lambda x: x['sql_idx'])
 
@@ -190,7 +601,7 @@ def compute_ves(exec_results):
         if result['time_ratio'] != 0:
             count += 1
         total_ratio += math.sqrt(result['time_ratio']) * 100
-    ves = (total_ratio/num_queries)
+    ves = (total_ratio/num_queries) if num_queries else 0
     return ves
 
 def compute_ves_by_diff(exec_results, difficulty_list):
@@ -211,12 +622,12 @@ def compute_ves_by_diff(exec_results, difficulty_list):
     count_lists = [len(simple_results), len(moderate_results), len(challenging_results), num_queries]
     return simple_ves, moderate_ves, challenging_ves, all_ves, count_lists
 
-def print_data(score_lists, count_lists):
+def print_data(score_lists, count_lists, metric='accuracy'):
     levels = ['simple', 'moderate', 'challenging', 'total']
     print("{:20} {:20} {:20} {:20} {:20}".format("", *levels))
     print("{:20} {:<20} {:<20} {:<20} {:<20}".format('count', *count_lists))
-    print('======================================    ACCURACY    =====================================')
-    print("{:20} {:<20.2f} {:<20.2f} {:<20.2f} {:<20.2f}".format('accuracy', *score_lists))
+    print('======================================    {:^8}    ====================================='.format(metric.upper()))
+    print("{:20} {:<20.2f} {:<20.2f} {:<20.2f} {:<20.2f}".format(metric, *score_lists))
 
 # ----------------------------
 # 主程序入口
@@ -238,25 +649,62 @@ if __name__ == '__main__':
     args_parser.add_argument('--mode_predict', type=str, default='gpt')
     args_parser.add_argument('--difficulty', type=str, default='simple')
     args_parser.add_argument('--diff_json_path', type=str, default='results/')
+    args_parser.add_argument('--exec_cache', action='store_true', help='复用流水线与历次评测的 SQL 执行结果缓存')
+    args_parser.add_argument('--gold_cache', action='store_true', help='预先计算并缓存 gold SQL 结果，评测时只执行预测 SQL')
+    args_parser.add_argument('--worker_pool', action='store_true', help='使用常驻 worker 进程池：按库分块、复用连接、超时由 SQLite 中止')
+    args_parser.add_argument('--chunk_size', type=int, default=16, help='--worker_pool 下每次分发给 worker 的同库任务数')
+    args_parser.add_argument('--eval_store', action='store_true', help='增量评测：只执行与历史记录相比有变化的预测 SQL（--ves 时不生效）')
+    args_parser.add_argument('--eval_store_path', type=str, default=EVAL_STORE.path)
+    args_parser.add_argument('--all_columns', action='store_true', help='一次评测预测文件中的所有 sql_* 字段，输出各阶段准确率与耗时')
+    args_parser.add_argument('--ves', action='store_true', help='对结果正确的 SQL 计时并输出 VES')
+    args_parser.add_argument('--ves_runs', type=int, default=10, help='VES 计时时每条 SQL 的执行次数')
     args = args_parser.parse_args()
+    if args.exec_cache:
+        enable_exec_cache()
+    if args.gold_cache:
+        enable_gold_cache()
 
     # 加载预测 SQL 查询和数据库路径
     pred_queries, db_paths, difficulty = package_sqls(args.predicted_sql_path, args.db_root_path, mode=args.mode_predict, data_mode=args.data_mode)
     # 加载真实 SQL 查询和数据库路径
     gt_queries, db_paths_gt, difficulty_gt = package_sqls(args.ground_truth_path, args.db_root_path, mode=args.mode_gt, data_mode=args.data_mode)
 
-    # 根据 question_id 匹配预测和真实数据
-    matched_queries, matched_db_paths, difficulty_list = match_predictions_with_ground_truth(pred_queries, gt_queries, db_paths, difficulty)
-
-    # 使用多进程并行执行 SQL 查询，带有进度条显示
-    run_sqls_parallel(matched_queries, db_places=matched_db_paths, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out)
-    exec_result = sort_results(exec_result)
+    if args.gold_cache:
+        # 已缓存的 gold 直接跳过，只有数据库文件变化或新增的 gold 才会执行
+        precompute_gold(gt_queries, db_paths_gt, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out)
 
-    print('start calculate')
-    simple_acc, moderate_acc, challenging_acc, acc, count_lists = compute_acc_by_diff(exec_result, difficulty_list)
-    score_lists = [simple_acc, moderate_acc, challenging_acc, acc]
-    # simple_ves, moderate_ves, challenging_ves, ves, count_lists = compute_ves_by_diff(exec_result, difficulty_list)
-    # score_lists = [simple_ves, moderate_ves, challenging_ves, ves]
-    print_data(score_lists, count_lists)
+    if args.all_columns:
+        matrix = evaluate_all_columns(args.predicted_sql_path, gt_queries, db_paths_gt, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out)
+        print_matrix(matrix, difficulty_gt)
+    else:
+        # 根据 question_id 匹配预测和真实数据
+        matched_queries, matched_db_paths, difficulty_list = match_predictions_with_ground_truth(pred_queries, gt_queries, db_paths, difficulty)
+
+        def run_engine(sqls, db_places):
+            # 使用多进程并行执行 SQL 查询，带有进度条显示
+            if args.ves:
+                run_ves_parallel(sqls, db_places=db_places, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out, runs=args.ves_runs)
+            elif args.worker_pool:
+                run_sqls_pooled(sqls, db_places=db_places, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out, chunk_size=args.chunk_size)
+            else:
+                run_sqls_parallel(sqls, db_places=db_places, num_cpus=args.num_cpus, meta_time_out=args.meta_time_out)
+            return sort_results(exec_result)
+
+        if args.eval_store and not args.ves:
+            # 与 match_predictions_with_ground_truth 的遍历顺序一致
+            matched_ids = [question_id for question_id in pred_queries if question_id in gt_queries]
+            exec_result = run_incremental(EvalStore(args.eval_store_path), matched_ids, matched_queries, matched_db_paths, run_engine)
+        else:
+            exec_result = run_engine(matched_queries, matched_db_paths)
+
+        print('start calculate')
+        simple_acc, moderate_acc, challenging_acc, acc, count_lists = compute_acc_by_diff(exec_result, difficulty_list)
+        score_lists = [simple_acc, moderate_acc, challenging_acc, acc]
+        # simple_ves, moderate_ves, challenging_ves, ves, count_lists = compute_ves_by_diff(exec_result, difficulty_list)
+        # score_lists = [simple_ves, moderate_ves, challenging_ves, ves]
+        print_data(score_lists, count_lists)
+        if args.ves:
+            simple_ves, moderate_ves, challenging_ves, ves, count_lists = compute_ves_by_diff(exec_result, difficulty_list)
+            print_data([simple_ves, moderate_ves, challenging_ves, ves], count_lists, metric='ves')
     print('===========================================================================================')
     print("Finished evaluation")
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+from collections import Counter, defaultdict
+from urllib.request import pathname2url
+import sqlglot
+from sqlglot import exp
+from config import DEV, DB_INDEX
+from utils.db_pool import sql_deadline
+from utils.exec_cache import normalize_sql
+
+# 索引顾问：从 gold SQL 与流水线输出中挖掘过滤谓词与连接键，在数据库副本上建索引并对比前后耗时。
+#   - 同一张表上的等值列在前、第一个范围列在后组成索引键，列数不多时把查询用到的其余列也放进去做成覆盖索引；
+#   - 连接键单独建单列索引，已是 INTEGER PRIMARY KEY 或已有同前缀索引的列跳过；
+#   - 只在 DB_INDEX.indexed_databases_path 下的副本上建索引，原始库只以只读方式打开。
+# 副本目录结构与 dev_databases 相同，把 DEV.dev_databases_path 或 evaluation 的 --db_root_path 指向它即可使用。
+# 用法：python src/index_advisor.py --pred_paths a.jsonl b.jsonl [--dbs california_schools,financial]
+
+EQUALITY = (exp.EQ, exp.In)
+RANGE = (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)
+
+
+def db_file(root, db_name):
+    return os.path.join(root, db_name, f"{db_name}.sqlite")
+
+
+def connect_ro(db_path):
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri = True)
+
+
+def load_queries(gold_path, pred_paths, db_names = None):
+    """
+    返回去重后的 [(question_id, db, source, sql)]，gold 与各列预测中规范化后相同的 SQL 只保留一条
+    """
+    queries = []
+    with open(gold_path, 'r', encoding='utf-8') as f:
+        for item in json.load(f):
+            queries.append((item["question_id"], item["db_id"], "gold", item["SQL"]))
+    for pred_path in pred_paths:
+        with open(pred_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                for key, value in item.items():
+                    if key.startswith("sql_") and isinstance(value, str) and value.strip():
+                        queries.append((item["question_id"], item["db"], key, value))
+
+    seen = set()
+    unique = []
+    for question_id, db_name, source, sql in queries:
+        if db_names and db_name not in db_names:
+            continue
+        key = (db_name, normalize_sql(sql))
+        if key not in seen:
+            seen.add(key)
+            unique.append((question_id, db_name, source, sql))
+    return unique
+
+
+def load_schema(conn):
+    """
+    返回 {小写表名: {"name": 原表名, "columns": {小写列名: 原列名}, "rowid": INTEGER 主键列, "indexed": 已有索引的首列集合}}
+    """
+    schema = {}
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    for table in tables:
+        info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+        pks = [r for r in info if r[5]]
+        rowid = pks[0][1].lower() if len(pks) == 1 and pks[0][2].upper() == "INTEGER" else None
+        indexed = set()
+        for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            first = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchone()
+            if first is not None and first[2] is not None:
+                indexed.add(first[2].lower())
+        schema[table.lower()] = {
+            "name": table,
+            "columns": {r[1].lower(): r[1] for r in info},
+            "rowid": rowid,
+            "indexed": indexed,
+        }
+    return schema
+
+
+def mine_query(sql, schema):
+    """
+    解析一条 SQL，返回 (索引候选集合, 连接键集合)，元素均为 (小写表名, 列元组)
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read = "sqlite")
+    except Exception:
+        return set(), set()
+    aliases = {t.alias_or_name.lower(): t.name.lower() for t in tree.find_all(exp.Table) if t.name.lower() in schema}
+    query_tables = set(aliases.values())
+
+    def resolve(column):
+        name = column.name.lower()
+        if column.table:
+            table = aliases.get(column.table.lower())
+        else:
+            owners = [t for t in query_tables if name in schema[t]["columns"]]
+            table = owners[0] if len(owners) == 1 else None
+        if table is None or name not in schema[table]["columns"]:
+            return None
+        return table, name
+
+    referenced = defaultdict(set)
+    for column in tree.find_all(exp.Column):
+        resolved = resolve(column)
+        if resolved:
+            referenced[resolved[0]].add(resolved[1])
+
+    equalities = defaultdict(list)
+    ranges = defaultdict(list)
+    join_keys = set()
+
+    def visit(predicate):
+        left = predicate.this
+        if isinstance(predicate, exp.EQ) and isinstance(left, exp.Column) and isinstance(predicate.expression, exp.Column):
+            for side in (left, predicate.expression):
+                resolved = resolve(side)
+                if resolved:
+                    join_keys.add((resolved[0], (resolved[1],)))
+            return
+        # 另一侧是常量或子查询的过滤谓词；兼容 "1 = T.col" 的写法
+        if isinstance(predicate, (exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)) and not isinstance(left, exp.Column):
+            left = predicate.expression
+        if not isinstance(left, exp.Column):
+            return
+        resolved = resolve(left)
+        if resolved is None:
+            return
+        target = equalities if isinstance(predicate, EQUALITY) else ranges
+        if resolved[1] not in target[resolved[0]]:
+            target[resolved[0]].append(resolved[1])
+
+    for clause in list(tree.find_all(exp.Where)) + [j.args["on"] for j in tree.find_all(exp.Join) if j.args.get("on")]:
+        for predicate in clause.find_all(*EQUALITY, *RANGE):
+            visit(predicate)
+
+    candidates = set()
+    for table in set(equalities) | set(ranges):
+        key = sorted(equalities[table]) + ranges[table][:1]
+        include = sorted(referenced[table] - set(key))
+        # 只含谓词列的索引也计入支持度，谓词相同、查询列不同的 SQL 至少能共用它
+        candidates.add((table, tuple(key)))
+        if include and len(key) + len(include) <= DB_INDEX.max_covering_columns:
+            candidates.add((table, tuple(key + include)))
+    return candidates, join_keys
+
+
+def advise(queries, schema):
+    """
+    按支持度挑选索引：被不少于 min_support 条 SQL 用到的候选，互为前缀的只保留较长的一个
+    """
+    support = Counter()
+    for _, _, _, sql in queries:
+        candidates, join_keys = mine_query(sql, schema)
+        for candidate in candidates | join_keys:
+            support[candidate] += 1
+
+    chosen = defaultdict(list)
+    for (table, columns), count in sorted(support.items(), key = lambda x: (-x[1], -len(x[0][1]))):
+        if count < DB_INDEX.min_support or len(chosen[table]) >= DB_INDEX.max_indexes_per_table:
+            continue
+        if len(columns) == 1 and (columns[0] == schema[table]["rowid"] or columns[0] in schema[table]["indexed"]):
+            continue
+        if any(existing[:len(columns)] == columns for existing in chosen[table]):
+            continue
+        # 已选索引是新索引的前缀时，新索引可以完全替代它
+        chosen[table] = [existing for existing in chosen[table] if columns[:len(existing)] != existing] + [columns]
+    return [(table, columns) for table, indexes in chosen.items() for columns in indexes]
+
+
+def index_name(table, columns):
+    return re.sub(r"\W", "_", f"advisor_{table}_{'_'.join(columns)}")
+
+
+def build_indexed_copy(db_name, indexes, schema, source_root, target_root):
+    """
+    复制整个数据库目录到 target_root 后在副本上建索引，副本已存在时用原始库文件覆盖后重建
+    """
+    source, target = db_file(source_root, db_name), db_file(target_root, db_name)
+    if os.path.realpath(source) == os.path.realpath(target):
+        raise ValueError(f"索引副本路径与原始数据库相同: {source}")
+    if not os.path.exists(os.path.dirname(target)):
+        shutil.copytree(os.path.dirname(source), os.path.dirname(target))
+    else:
+        shutil.copy2(source, target)
+
+    conn = sqlite3.connect(target)
+    try:
+        for table, columns in indexes:
+            column_list = ", ".join(f'"{schema[table]["columns"][c]}"' for c in columns)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name(table, columns)}" ON "{schema[table]["name"]}" ({column_list})')
+        # 让查询规划器拿到新索引的统计信息
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    return target
+
+
+def time_query(conn, sql, timeout, runs):
+    """
+    返回多次执行中最短的耗时；超时返回 "timeout"，报错返回 "error"
+    """
+    best = None
+    for _ in range(runs):
+        start_time = time.time()
+        state = {"expired": False}
+        try:
+            with sql_deadline(conn, timeout) as state:
+                cursor = conn.execute(sql)
+                while cursor.fetchmany(1000):
+                    pass
+        except sqlite3.Error:
+            return "timeout" if state["expired"] else "error"
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def used_indexes(conn, sql):
+    try:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    except sqlite3.Error:
+        return []
+    return sorted({m for row in plan for m in re.findall(r"advisor_\w+", row[3])})
+
+
+def compare(db_name, queries, source, target, timeout, runs):
+    reports = []
+    before_conn, after_conn = connect_ro(source), connect_ro(target)
+    try:
+        for question_id, _, origin, sql in queries:
+            before = time_query(before_conn, sql, timeout, runs)
+            after = time_query(after_conn, sql, timeout, runs)
+            speedup = None
+            if isinstance(before, float) and isinstance(after, float) and after > 0:
+                speedup = round(before / after, 2)
+            reports.append({
+                "question_id": question_id,
+                "db": db_name,
+                "source": origin,
+                "before": round(before, 4) if isinstance(before, float) else before,
+                "after": round(after, 4) if isinstance(after, float) else after,
+                "speedup": speedup,
+                "indexes": used_indexes(after_conn, sql),
+            })
+    finally:
+        before_conn.close()
+        after_conn.close()
+    return reports
+
+
+def print_summary(reports):
+    by_db = defaultdict(list)
+    for r in reports:
+        by_db[r["db"]].append(r)
+    header = ["db", "queries", "before", "after", "faster", "slower", "timeouts_fixed"]
+    rows = []
+    for db_name, items in sorted(by_db.items()):
+        timed = [r for r in items if isinstance(r["before"], float) and isinstance(r["after"], float)]
+        rows.append([
+            db_name, str(len(items)),
+            f"{sum(r['before'] for r in timed):.2f}s", f"{sum(r['after'] for r in timed):.2f}s",
+            str(sum(1 for r in timed if r["speedup"] and r["speedup"] >= 1.2)),
+            str(sum(1 for r in timed if r["speedup"] and r["speedup"] <= 0.8)),
+            str(sum(1 for r in items if r["before"] == "timeout" and isinstance(r["after"], float))),
+        ])
+    widths = [max(len(h), *(len(r[i]) for r in rows)) if rows else len(h) for i, h in enumerate(header)]
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for r in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(r, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gold_path", type = str, default = DEV.dev_json_path)
+    parser.add_argument("--pred_paths", type = str, nargs = "*", default = [], help = "流水线输出的 jsonl，读取其中所有 sql_* 字段")
+    parser.add_argument("--db_root_path", type = str, default = DEV.dev_databases_path)
+    parser.add_argument("--output_root", type = str, default = DB_INDEX.indexed_databases_path)
+    parser.add_argument("--dbs", type = str, default = None, help = "逗号分隔的库名，默认处理全部")
+    parser.add_argument("--report_path", type = str, default = DB_INDEX.report_path)
+    parser.add_argument("--timeout", type = float, default = DB_INDEX.timeout)
+    parser.add_argument("--runs", type = int, default = DB_INDEX.runs)
+    parser.add_argument("--skip_timing", action = "store_true", help = "只建索引，不对比执行耗时")
+    args = parser.parse_args()
+
+    db_names = set(args.dbs.split(",")) if args.dbs else None
+    queries_by_db = defaultdict(list)
+    for query in load_queries(args.gold_path, args.pred_paths, db_names):
+        queries_by_db[query[1]].append(query)
+
+    reports = []
+    for db_name, queries in sorted(queries_by_db.items()):
+        source = db_file(args.db_root_path, db_name)
+        conn = connect_ro(source)
+        try:
+            schema = load_schema(conn)
+        finally:
+            conn.close()
+        indexes = advise(queries, schema)
+        target = build_indexed_copy(db_name, indexes, schema, args.db_root_path, args.output_root)
+        print(f"{db_name}: {len(queries)} 条 SQL，创建 {len(indexes)} 个索引")
+        for table, columns in indexes:
+            print(f"  {index_name(table, columns)}")
+        if not args.skip_timing:
+            reports.extend(compare(db_name, queries, source, target, args.timeout, args.runs))
+
+    if reports:
+        dir_name = os.path.dirname(args.report_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok = True)
+        with open(args.report_path, 'w', encoding='utf-8') as f:
+            for r in reports:
+                f.write(json.dumps(r, ensure_ascii = False) + "\n")
+        print()
+        print_summary(reports)
+        print(f"\n逐条耗时已写入 {args.report_path}")
@@ -1,43 +1,373 @@
+import os
+import sys
 import openai
 import json
+import time
+import asyncio
 import requests
-from config import QWEN
+from config import QWEN, LLM_CACHE, LLM_ASYNC, LLM_THROTTLE, LLM_CLIENT, LLM_BATCH, LLM_BACKEND, LLM_HEDGE, LLM_METRICS
+from utils.llm_cache import make_cache_key, get_llm_cache, enable_llm_cache, log_llm_cache_stats
+from utils.llm_throttle import get_llm_limiter, is_throttle_error, get_retry_after
+from utils.json_stream import JsonAnswerDetector, stream_stats
+from utils.llm_response import structured_output, is_response_format_error, parse_stats
+from utils.llm_client import get_openai_client, get_async_openai_client, configure_llm_client, get_connection_stats
+from utils.llm_batch import PendingLLMCall, LocalBatchClient, is_collecting, configure_llm_batch
+from utils.llm_backend import get_llm_backend, configure_llm_backend, available_backends
+from utils.llm_hedge import enable_hedging, get_hedge_policy
+from utils.llm_metrics import enable_llm_metrics, record_llm_call, usage_of
 import logging
 
 logging.basicConfig(level = logging.INFO, format = '%(asctime)s - %(levelname)s - %(name)s - %(message)s')
 
+# 是否对声明了 answer_key 的调用使用流式响应并在答案完整后提前结束，由 --llm_stream 开启
+_stream_answers = False
+
+def build_messages(instruction, prompt):
+    return [
+        {"role": "system", "content": instruction},
+        {"role": "user", "content": prompt},
+    ]
+
+def request_key(messages, response_format = None):
+    """
+    请求的内容寻址 key，缓存、批量模式与录制回放共用
+    """
+    params = {"temperature": 0}
+    if response_format is not None:
+        params["response_format"] = response_format
+    return make_cache_key(QWEN.model, messages, **params)
+
+def lookup_cache(messages, response_format = None):
+    """
+    查询 LLM 缓存，返回 (cache, cache_key, cached)；未启用缓存时 cache 与 cached 为 None
+    """
+    cache = get_llm_cache()
+    cache_key = request_key(messages, response_format)
+    if cache is None:
+        return None, cache_key, None
+    return cache, cache_key, cache.get(cache_key)
+
+def format_kwargs(response_format):
+    return {"response_format": response_format} if response_format is not None else {}
+
+def batch_request_body(messages, response_format = None):
+    """
+    与实时调用参数一致的 /v1/chat/completions 请求体，保证 batch 结果能按同一个缓存键命中
+    """
+    return {"model": QWEN.model, "messages": messages, "temperature": 0, **format_kwargs(response_format)}
+
+def get_batch_client(args):
+    if args.llm_batch_local:
+        # 回放后端下，本地 batch 服务直接返回录制的回复
+        backend = get_llm_backend()
+        responder = None
+        if backend.replays:
+            responder = lambda body: backend.lookup(request_key(body["messages"], body.get("response_format")))[0]
+        return LocalBatchClient(args.llm_batch_dir, responder)
+    return get_openai_client()
+
 class QWEN_LLM:
     def __init__(self):
-        self.client = openai.OpenAI(api_key = QWEN.api, base_url = QWEN.base_url)
+        # 所有实例共享进程级客户端与连接池，构造开销可以忽略
+        self.client = get_openai_client()
+
+    def __call__(self, instruction, prompt, answer_key = None, response_format = None, call_site = None):
+        """
+        answer_key: 期望回复为包含该字段的 JSON 对象（如 "sql"）；开启流式模式时，
+        一旦收到完整可解析的答案对象就提前关闭流
+        response_format: 开启结构化输出时使用的格式，缺省时由 answer_key 生成 json_schema
+        call_site: 调用点名称（如 "fix_sql"），用于 token 与延迟记账
+        """
+        messages = build_messages(instruction, prompt)
+        fmt = structured_output.format_for(answer_key, response_format)
+
+        # 命中缓存则直接返回，不再请求 LLM
+        cache, cache_key, cached = lookup_cache(messages, fmt)
+        if cached is not None:
+            record_llm_call(call_site, "cached", 0.0)
+            return cached
+        # 批量模式：记录请求并中断当前条目，等 batch 结果写回缓存后重跑
+        if is_collecting():
+            raise PendingLLMCall(cache_key, batch_request_body(messages, fmt))
 
-    def __call__(self, instruction, prompt):
+        backend = get_llm_backend()
+        call_start = time.time()
+        content = backend.complete(cache_key, messages, fmt,
+                                   lambda: self._send(messages, answer_key, response_format, fmt, cache, cache_key, call_site, call_start))
+        if backend.replays:
+            record_llm_call(call_site, "replayed", time.time() - call_start)
+        return content
+
+    def _send(self, messages, answer_key, response_format, fmt, cache, cache_key, call_site, call_start):
+        """
+        实时请求：限流、重试、结构化输出降级与对冲，成功后通知后端并写入缓存
+        """
+        backend = get_llm_backend()
+        limiter = get_llm_limiter()
         num = 0
-        max_retries = 3  # 限制最大重试次数
-        response = None
+        max_retries = LLM_THROTTLE.max_retries  # 限制最大重试次数
+        downgrades = 0
+        max_downgrades = len(structured_output.LEVELS) - 1
 
         while num < max_retries:
+            limiter.acquire()
+            start_time = time.time()
             try:
-                response = self.client.chat.completions.create(
-                    model = QWEN.model,
-                    messages=[
-                        {"role": "system", "content": instruction},
-                        {"role": "user", "content": prompt},
-                    ],
-                    stream=False,
-                    temperature=0
-                )
-
-                # 解析 JSON，确保返回的是有效 JSON
-                content = response.choices[0].message.content
-                return content  # 解析成功，返回内容
-
-            except json.JSONDecodeError:
-                print(f"Warning: Response is not a valid JSON. Retrying {num + 1}/{max_retries}...")
+                hedge = get_hedge_policy()
+                if hedge is not None:
+                    content, usage = hedge.run(lambda cancel: self._complete(messages, answer_key, fmt, cancel))
+                else:
+                    content, usage = self._complete(messages, answer_key, fmt)
+            except Exception as e:
+                if fmt is not None and is_response_format_error(e) and downgrades < max_downgrades:
+                    # 服务端不支持该 response_format：降级后立即重试，不计入失败次数，降级次数单独限制
+                    limiter.release(time.time() - start_time, ok = False)
+                    downgrades += 1
+                    structured_output.downgrade(fmt)
+                    fmt = structured_output.format_for(answer_key, response_format)
+                    continue
+                limiter.release(time.time() - start_time, ok = False, throttled = is_throttle_error(e))
                 num += 1
-                
+                if num < max_retries:
+                    delay = limiter.backoff_delay(num, get_retry_after(e))
+                    print(f"Error: {e}. Retrying {num}/{max_retries} in {delay:.1f}s...")
+                    time.sleep(delay)
+                continue
+
+            latency = time.time() - start_time
+            limiter.release(latency)
+            backend.observe(cache_key, messages, fmt, content, latency)
+            record_llm_call(call_site, "ok", time.time() - call_start, usage, num)
+            if cache is not None:
+                cache.put(cache_key, content)
+            return content
+
+        logging.error(f"LLM 请求在 {max_retries} 次尝试后仍失败")
+        record_llm_call(call_site, "failed", time.time() - call_start, retries = num)
+        return None  # 失败后返回 None，防止后续代码崩溃
+
+    def _complete(self, messages, answer_key, fmt, cancel = None):
+        """
+        发出一次请求，返回 (回复文本, token 用量)；流式请求拿不到用量，为 None
+        """
+        if _stream_answers and answer_key is not None:
+            return self._complete_stream(messages, answer_key, fmt, cancel)
+        response = self.client.chat.completions.create(
+            model = QWEN.model,
+            messages = messages,
+            stream=False,
+            temperature=0,
+            **format_kwargs(fmt)
+        )
+        return response.choices[0].message.content, usage_of(response)
+
+    def _complete_stream(self, messages, answer_key, fmt, cancel = None):
+        detector = JsonAnswerDetector(answer_key)
+        stream = self.client.chat.completions.create(
+            model = QWEN.model,
+            messages = messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            temperature=0,
+            **format_kwargs(fmt)
+        )
+        usage = None
+        try:
+            for chunk in stream:
+                # 对冲请求中输掉的一方：关闭流放弃生成
+                if cancel is not None and cancel.is_set():
+                    return None, None
+                # include_usage 时用量在最后一个（choices 为空的）chunk 中
+                usage = usage_of(chunk) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if detector.feed(chunk.choices[0].delta.content) is not None:
+                        break
+        finally:
+            # 关闭底层 HTTP 响应，服务端随之停止生成
+            stream.close()
+        stream_stats.record(detector.answer is not None)
+        # 提前结束时只返回答案对象本身，前面的推理文本可能含有干扰 extract_json 的花括号；
+        # 提前关闭的流收不到最后的用量 chunk，usage 为 None
+        return (detector.answer if detector.answer is not None else detector.text), usage
+
+class QWEN_LLM_CODER(QWEN_LLM):
+    """
+    SQL 生成 / 修复阶段使用的 coder 模型，当前与 QWEN.model 为同一端点
+    """
+    pass
+
+class AsyncQWEN_LLM:
+    """
+    基于 AsyncOpenAI 的协程版本，调用方式为 await llm(instruction, prompt)，
+    与 QWEN_LLM 共用同一份缓存和并发控制器
+    """
+    @property
+    def client(self):
+        # AsyncOpenAI 绑定事件循环，按当前循环从注册表中获取
+        return get_async_openai_client()
+
+    async def __call__(self, instruction, prompt, answer_key = None, response_format = None, call_site = None):
+        messages = build_messages(instruction, prompt)
+        fmt = structured_output.format_for(answer_key, response_format)
 
+        cache, cache_key, cached = lookup_cache(messages, fmt)
+        if cached is not None:
+            record_llm_call(call_site, "cached", 0.0)
+            return cached
+        # 批量模式：记录请求并中断当前条目，等 batch 结果写回缓存后重跑
+        if is_collecting():
+            raise PendingLLMCall(cache_key, batch_request_body(messages, fmt))
+
+        backend = get_llm_backend()
+        call_start = time.time()
+        content = await backend.acomplete(cache_key, messages, fmt,
+                                          lambda: self._send(messages, answer_key, response_format, fmt, cache, cache_key, call_site, call_start))
+        if backend.replays:
+            record_llm_call(call_site, "replayed", time.time() - call_start)
+        return content
+
+    async def _send(self, messages, answer_key, response_format, fmt, cache, cache_key, call_site, call_start):
+        backend = get_llm_backend()
+        limiter = get_llm_limiter()
+        num = 0
+        max_retries = LLM_THROTTLE.max_retries
+        downgrades = 0
+        max_downgrades = len(structured_output.LEVELS) - 1
+
+        while num < max_retries:
+            await limiter.acquire_async()
+            start_time = time.time()
+            try:
+                hedge = get_hedge_policy()
+                if hedge is not None:
+                    content, usage = await hedge.run_async(lambda: self._complete(messages, answer_key, fmt))
+                else:
+                    content, usage = await self._complete(messages, answer_key, fmt)
             except Exception as e:
-                print(f"Error: {e}. Retrying {num + 1}/{max_retries}...")
+                if fmt is not None and is_response_format_error(e) and downgrades < max_downgrades:
+                    # 服务端不支持该 response_format：降级后立即重试，不计入失败次数，降级次数单独限制
+                    limiter.release(time.time() - start_time, ok = False)
+                    downgrades += 1
+                    structured_output.downgrade(fmt)
+                    fmt = structured_output.format_for(answer_key, response_format)
+                    continue
+                limiter.release(time.time() - start_time, ok = False, throttled = is_throttle_error(e))
                 num += 1
-                
-        return None  # 失败后返回 None，防止后续代码崩溃
\ No newline at end of file
+                if num < max_retries:
+                    delay = limiter.backoff_delay(num, get_retry_after(e))
+                    print(f"Error: {e}. Retrying {num}/{max_retries} in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+                continue
+
+            latency = time.time() - start_time
+            limiter.release(latency)
+            backend.observe(cache_key, messages, fmt, content, latency)
+            record_llm_call(call_site, "ok", time.time() - call_start, usage, num)
+            if cache is not None:
+                cache.put(cache_key, content)
+            return content
+
+        logging.error(f"LLM 请求在 {max_retries} 次尝试后仍失败")
+        record_llm_call(call_site, "failed", time.time() - call_start, retries = num)
+        return None
+
+    async def _complete(self, messages, answer_key, fmt):
+        if _stream_answers and answer_key is not None:
+            return await self._complete_stream(messages, answer_key, fmt)
+        response = await self.client.chat.completions.create(
+            model = QWEN.model,
+            messages = messages,
+            stream=False,
+            temperature=0,
+            **format_kwargs(fmt)
+        )
+        return response.choices[0].message.content, usage_of(response)
+
+    async def _complete_stream(self, messages, answer_key, fmt):
+        detector = JsonAnswerDetector(answer_key)
+        stream = await self.client.chat.completions.create(
+            model = QWEN.model,
+            messages = messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            temperature=0,
+            **format_kwargs(fmt)
+        )
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = usage_of(chunk) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if detector.feed(chunk.choices[0].delta.content) is not None:
+                        break
+        finally:
+            await stream.close()
+        stream_stats.record(detector.answer is not None)
+        # 提前结束时只返回答案对象本身，前面的推理文本可能含有干扰 extract_json 的花括号；
+        # 提前关闭的流收不到最后的用量 chunk，usage 为 None
+        return (detector.answer if detector.answer is not None else detector.text), usage
+
+
+def add_llm_arguments(parser):
+    """
+    为各阶段的命令行添加 LLM 相关的公共参数
+    """
+    parser.add_argument("--llm-cache", action = "store_true", help = "启用 LLM 响应磁盘缓存")
+    parser.add_argument("--llm_cache_path", type = str, default = LLM_CACHE.path)
+    parser.add_argument("--llm_cache_max_bytes", type = int, default = LLM_CACHE.max_bytes)
+    parser.add_argument("--use_async", action = "store_true", help = "使用 asyncio 驱动代替线程池")
+    parser.add_argument("--concurrency", type = int, default = LLM_ASYNC.concurrency, help = "异步模式下同时在途的请求数")
+    parser.add_argument("--llm_stream", action = "store_true", help = "流式接收回复，JSON 答案完整后立即结束")
+    parser.add_argument("--llm_structured", action = "store_true", help = "请求 response_format 结构化输出，服务端不支持时自动降级")
+    parser.add_argument("--llm_pool_size", type = int, default = None, help = "HTTP 连接池大小，默认取线程数或异步并发数")
+    parser.add_argument("--llm_batch", action = "store_true", help = "离线批量模式：通过 /v1/batches 提交整个阶段的请求")
+    parser.add_argument("--llm_batch_local", action = "store_true", help = "批量模式使用本地文件模拟的 batch 服务")
+    parser.add_argument("--llm_batch_dir", type = str, default = LLM_BATCH.workdir)
+    parser.add_argument("--llm_backend", type = str, default = LLM_BACKEND.name, choices = available_backends(),
+                        help = "record 录制实时回复，replay 离线回放录制文件")
+    parser.add_argument("--llm_recording", type = str, default = LLM_BACKEND.recording_path)
+    parser.add_argument("--llm_replay_latency", type = str, default = LLM_BACKEND.replay_latency,
+                        help = "回放时的合成延迟：none / recorded / fixed:秒 / uniform:a,b / lognormal:mu,sigma")
+    parser.add_argument("--llm_hedge", action = "store_true", help = "调用耗时超过延迟分位数时发出对冲请求")
+    parser.add_argument("--llm_hedge_percentile", type = float, default = LLM_HEDGE.percentile)
+    parser.add_argument("--llm_metrics", action = "store_true", help = "记录每次 LLM 调用的 token 与延迟")
+    parser.add_argument("--llm_metrics_path", type = str, default = LLM_METRICS.path)
+
+
+def configure_llm(args):
+    """
+    根据命令行参数初始化进程级的 LLM 设置
+    """
+    global _stream_answers
+    # 批量模式依赖缓存在轮次之间传递 batch 结果
+    if args.llm_cache or args.llm_batch:
+        enable_llm_cache(args.llm_cache_path, args.llm_cache_max_bytes)
+    _stream_answers = args.llm_stream
+    configure_llm_batch(args.llm_batch_dir)
+    configure_llm_backend(args.llm_backend, path = args.llm_recording, latency = args.llm_replay_latency)
+    if args.llm_hedge:
+        enable_hedging(args.llm_hedge_percentile)
+    if args.llm_metrics:
+        # 以脚本名作为阶段名，如 4_cot_self_correction
+        enable_llm_metrics(args.llm_metrics_path, os.path.splitext(os.path.basename(sys.argv[0]))[0])
+    structured_output.enabled = args.llm_structured
+
+    pool_size = args.llm_pool_size
+    if pool_size is None:
+        pool_size = args.concurrency if args.use_async else getattr(args, "max_workers", LLM_CLIENT.pool_size)
+    configure_llm_client(pool_size)
+
+
+def log_llm_stats():
+    """
+    阶段结束时输出 LLM 缓存与并发控制器的统计信息
+    """
+    log_llm_cache_stats()
+    logging.info(f"LLM 后端统计: {get_llm_backend().stats()}")
+    logging.info(f"LLM 并发控制统计: {get_llm_limiter().stats()}")
+    logging.info(f"LLM 连接复用统计: {get_connection_stats()}")
+    if _stream_answers:
+        logging.info(f"LLM 流式提前结束统计: {stream_stats.snapshot()}")
+    logging.info(f"LLM 回复解析统计: {parse_stats.snapshot()}")
+    if get_hedge_policy() is not None:
+        logging.info(f"LLM 对冲请求统计: {get_hedge_policy().stats()}")
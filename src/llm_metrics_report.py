@@ -0,0 +1,59 @@
+import json
+import argparse
+from config import LLM_METRICS
+from utils.llm_metrics import summarize
+
+# 汇总 --llm_metrics 记录的 LLM 调用：各阶段 / 调用点的 p50、p95 延迟、token 总量与费用
+# 用法：python src/llm_metrics_report.py --metrics_file cache/llm_metrics.jsonl [--by_site]
+
+
+def load_records(metrics_file, stage = None):
+    records = []
+    with open(metrics_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if stage is None or record.get("stage") == stage:
+                records.append(record)
+    return records
+
+
+def fmt_latency(value):
+    return f"{value:.2f}s" if value is not None else "-"
+
+
+def print_summary(summary, group_names):
+    header = group_names + ["calls", "cached", "failed", "retries", "p50", "p95", "prompt_tok", "compl_tok", "cost"]
+    rows = []
+    for key, s in summary.items():
+        rows.append([str(k) for k in key] + [
+            str(s["calls"]), str(s["cached"]), str(s["failed"]), str(s["retries"]),
+            fmt_latency(s["p50"]), fmt_latency(s["p95"]),
+            str(s["prompt_tokens"]), str(s["completion_tokens"]), f"{s['cost']:.4f}",
+        ])
+    widths = [max(len(h), *(len(r[i]) for r in rows)) if rows else len(h) for i, h in enumerate(header)]
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for r in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(r, widths)))
+
+    no_usage = sum(s["no_usage"] for s in summary.values())
+    if no_usage:
+        print(f"\n注意：{no_usage} 次调用没有返回 token 用量（答案完整后提前关闭的流式请求收不到最后的用量 chunk），未计入 token 与费用")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metrics_file", type = str, default = LLM_METRICS.path)
+    parser.add_argument("--stage", type = str, default = None, help = "只统计某个阶段")
+    parser.add_argument("--by_site", action = "store_true", help = "按调用点细分")
+    parser.add_argument("--prompt_price", type = float, default = LLM_METRICS.prompt_price, help = "元 / 千 token")
+    parser.add_argument("--completion_price", type = float, default = LLM_METRICS.completion_price, help = "元 / 千 token")
+    args = parser.parse_args()
+
+    records = load_records(args.metrics_file, args.stage)
+    group_keys = ["stage", "call_site"] if args.by_site else ["stage"]
+    summary = summarize(records, group_keys, args.prompt_price, args.completion_price)
+    print_summary(summary, group_keys)
+    print(f"\n共 {len(records)} 次调用，总费用 {sum(s['cost'] for s in summary.values()):.4f} 元")
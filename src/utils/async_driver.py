@@ -0,0 +1,37 @@
+import json
+import asyncio
+import logging
+import concurrent.futures
+from tqdm import tqdm
+
+# 各阶段共用的 asyncio 驱动：用一个信号量控制同时在途的请求数，
+# 替代 ThreadPoolExecutor 的线程扇出，单进程即可维持数百个并发 LLM 请求。
+# 多步修复流程较长的阶段（3、4）不另写协程版本，worker 用 asyncio.to_thread 运行同步的 process_item，
+# 默认线程池按 concurrency 扩容，信号量放行的条目都能拿到线程。
+
+
+async def _run_items(items, worker, out_f, concurrency, desc):
+    semaphore = asyncio.Semaphore(concurrency)
+    asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers = concurrency))
+
+    async def _guarded(item):
+        async with semaphore:
+            return await worker(item)
+
+    tasks = [asyncio.create_task(_guarded(it)) for it in items]
+    for future in tqdm(asyncio.as_completed(tasks), total = len(tasks), desc = desc):
+        try:
+            result = await future
+            if result:
+                out_f.write(json.dumps(result, ensure_ascii = False) + "\n")
+                out_f.flush()
+        except Exception as e:
+            logging.error(f"处理异步任务时异常: {e}")
+
+
+def run_stage_async(items, worker, output_file, concurrency, desc = "Processing items"):
+    """
+    用协程 worker 并发处理 items，结果按完成顺序逐行写入 output_file（JSONL）
+    """
+    with open(output_file, 'w', encoding = 'utf-8') as out_f:
+        asyncio.run(_run_items(items, worker, out_f, concurrency, desc))
@@ -0,0 +1,190 @@
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+import contextlib
+from urllib.request import pathname2url
+from config import DEV, DB_POOL
+
+# 按数据库划分的只读 SQLite 连接池：
+#   - 以 mode=ro&immutable=1 的 URI 打开，跳过文件锁与变更检测；
+#   - 每个连接设置较大的 cache_size / mmap_size，页缓存在多次执行之间保持温热；
+#   - 线程归还后放回该库的空闲队列（LIFO，优先复用最近用过、缓存最热的连接）。
+# BIRD 的 dev 库在流水线运行期间不会被修改，immutable 是安全的。
+# 超时通过 progress_handler 实现：到达截止时间后 SQLite 在下一个检查点中止语句，
+# 查询真正停止并释放 CPU，而不是让超时的线程在后台继续跑完。
+
+
+def get_db_path(db_name):
+    return f'{DEV.dev_databases_path}/{db_name}/{db_name}.sqlite'
+
+
+# 数据库副本注册表（由 utils.db_replica 填充）：abspath -> {"uri": 内存副本 URI, "mmap_size": ...}
+# 注册后新建的连接改为连到内存副本，或使用覆盖整个文件的 mmap_size
+_replicas = {}
+
+
+def register_replica(db_path, uri = None, mmap_size = None):
+    _replicas[os.path.abspath(db_path)] = {"uri": uri, "mmap_size": mmap_size}
+
+
+def clear_replicas(memory_only = False):
+    for key in list(_replicas):
+        if not memory_only or _replicas[key]["uri"] is not None:
+            del _replicas[key]
+
+
+class SQLitePool:
+    def __init__(self,
+                 max_idle_per_db = DB_POOL.max_idle_per_db,
+                 cache_size_kb = DB_POOL.cache_size_kb,
+                 mmap_size = DB_POOL.mmap_size,
+                 immutable = DB_POOL.immutable):
+        self.max_idle_per_db = max_idle_per_db
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.immutable = immutable
+
+        self.acquires = 0
+        self.hits = 0
+        self.opened = 0
+        self.closed = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, db_path):
+        replica = _replicas.get(os.path.abspath(db_path))
+        if replica is not None and replica["uri"] is not None:
+            # 共享缓存的内存副本：所有连接共用同一份页面，无需再设置 cache_size / mmap_size
+            conn = sqlite3.connect(replica["uri"], uri = True, check_same_thread = False)
+            conn.execute("PRAGMA query_only = 1")
+            return conn
+
+        uri = f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        # 连接由池在线程间传递，同一时刻只被一个线程使用
+        conn = sqlite3.connect(uri, uri = True, check_same_thread = False)
+        conn.execute(f"PRAGMA cache_size = -{self.cache_size_kb}")
+        mmap_size = replica["mmap_size"] if replica is not None else self.mmap_size
+        conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+        return conn
+
+    def _idle_queue(self, db_path):
+        with self._lock:
+            return self._idle.setdefault(db_path, queue.LifoQueue())
+
+    def acquire(self, db_path):
+        idle = self._idle_queue(db_path)
+        try:
+            conn = idle.get_nowait()
+            hit = True
+        except queue.Empty:
+            conn = self._connect(db_path)
+            hit = False
+        with self._lock:
+            self.acquires += 1
+            if hit:
+                self.hits += 1
+            else:
+                self.opened += 1
+        return conn
+
+    def release(self, db_path, conn):
+        idle = self._idle_queue(db_path)
+        if idle.qsize() < self.max_idle_per_db:
+            idle.put(conn)
+            return
+        conn.close()
+        with self._lock:
+            self.closed += 1
+
+    @contextlib.contextmanager
+    def connection(self, db_path):
+        conn = self.acquire(db_path)
+        try:
+            yield conn
+        finally:
+            self.release(db_path, conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "acquires": self.acquires,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.acquires if self.acquires else 0.0,
+                "opened": self.opened,
+                "closed": self.closed,
+                "databases": len(self._idle),
+            }
+
+
+class SQLInterruptStats:
+    def __init__(self):
+        self.executed = 0
+        self.interrupted = 0
+        self.interrupted_cpu_time = 0.0  # 被中止的查询在中止前已消耗的 CPU 时间
+        self._lock = threading.Lock()
+
+    def record(self, interrupted, cpu_time):
+        with self._lock:
+            self.executed += 1
+            if interrupted:
+                self.interrupted += 1
+                self.interrupted_cpu_time += cpu_time
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "interrupted": self.interrupted,
+                "interrupted_cpu_time": round(self.interrupted_cpu_time, 3),
+            }
+
+
+sql_interrupt_stats = SQLInterruptStats()
+
+
+@contextlib.contextmanager
+def sql_deadline(conn, timeout):
+    """
+    在 conn 上设置截止时间，超时后正在执行的语句抛出 OperationalError: interrupted；
+    yield 的 dict 中 expired 表示是否因超时中止
+    """
+    deadline = time.time() + timeout
+    state = {"expired": False}
+    cpu_start = time.thread_time()
+
+    def check_deadline():
+        if time.time() > deadline:
+            state["expired"] = True
+            return 1
+        return 0
+
+    conn.set_progress_handler(check_deadline, DB_POOL.progress_steps)
+    try:
+        yield state
+    finally:
+        # 连接会被放回池中，必须清除本次的 handler
+        conn.set_progress_handler(None, 0)
+        sql_interrupt_stats.record(state["expired"], time.thread_time() - cpu_start)
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = SQLitePool()
+        return _db_pool
+
+
+def log_db_pool_stats():
+    if _db_pool is not None:
+        logging.info(f"SQLite 连接池统计: {_db_pool.stats()}")
+    logging.info(f"SQL 超时中止统计: {sql_interrupt_stats.snapshot()}")
@@ -0,0 +1,105 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+from urllib.request import pathname2url
+from config import DEV, DB_REPLICA
+from utils.db_pool import get_db_path, register_replica
+
+# 热点数据库副本管理：每个进程启动时加载一次，之后连接池里新建的连接自动使用副本。
+#   memory : 通过 SQLite backup API 把整个库复制到共享缓存的内存数据库，执行不再读磁盘；
+#   mmap   : 仍读原文件，但 mmap_size 覆盖整个文件并预读进页缓存，省掉 read() 拷贝。
+# 必须在第一次执行 SQL 之前加载，已经打开的连接不会切换到副本。
+
+
+def resolve_db_names(spec):
+    """
+    spec: 逗号分隔的库名；all 表示全部；top:N 表示文件最大的 N 个库
+    """
+    if spec.startswith("top:") or spec == "all":
+        names = [n for n in os.listdir(DEV.dev_databases_path) if os.path.exists(get_db_path(n))]
+        if spec == "all":
+            return sorted(names)
+        names.sort(key = lambda n: os.path.getsize(get_db_path(n)), reverse = True)
+        return names[:int(spec[4:])]
+    return [n.strip() for n in spec.split(",") if n.strip()]
+
+
+class ReplicaManager:
+    def __init__(self, mode = DB_REPLICA.mode):
+        if mode not in ("memory", "mmap"):
+            raise ValueError(f"未知的副本模式: {mode}")
+        self.mode = mode
+        self._replicas = {}
+        self._masters = {}  # 内存副本在最后一个连接关闭后即被释放，这里持有一个连接保活
+
+    def load(self, db_name):
+        if db_name in self._replicas:
+            return
+        db_path = get_db_path(db_name)
+        start_time = time.time()
+        if self.mode == "memory":
+            # 共享缓存的内存库按名字全局可见，用绝对路径的哈希命名，不同目录下的同名库不会串用
+            path_key = hashlib.sha1(os.path.abspath(db_path).encode("utf-8")).hexdigest()[:16]
+            uri = f"file:replica_{path_key}?mode=memory&cache=shared"
+            master = sqlite3.connect(uri, uri = True, check_same_thread = False)
+            source = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri = True)
+            try:
+                source.backup(master)
+            finally:
+                source.close()
+            page_count = master.execute("PRAGMA page_count").fetchone()[0]
+            page_size = master.execute("PRAGMA page_size").fetchone()[0]
+            self._masters[db_name] = master
+            resident = page_count * page_size
+            register_replica(db_path, uri = uri)
+        else:
+            resident = os.path.getsize(db_path)
+            # 顺序读一遍文件，让后续 mmap 访问直接命中页缓存
+            with open(db_path, "rb") as f:
+                while f.read(16 * 1024 * 1024):
+                    pass
+            register_replica(db_path, mmap_size = resident)
+        self._replicas[db_name] = {
+            "mode": self.mode,
+            "bytes": resident,
+            "load_time": round(time.time() - start_time, 3),
+        }
+        logging.info(f"已加载 {self.mode} 副本 {db_name}: {resident / 1024 / 1024:.1f} MB")
+
+    def load_all(self, db_names):
+        total = sum(r["bytes"] for r in self._replicas.values())
+        for db_name in db_names:
+            if db_name in self._replicas:
+                continue
+            # 加载前按文件大小检查上限，装不下的库跳过，后面更小的库仍可能装得下
+            size = os.path.getsize(get_db_path(db_name))
+            if total + size > DB_REPLICA.max_total_bytes:
+                logging.warning(f"加载 {db_name}（{size / 1024 / 1024:.1f} MB）会超过副本总大小上限 {DB_REPLICA.max_total_bytes}，跳过")
+                continue
+            self.load(db_name)
+            total += self._replicas[db_name]["bytes"]
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "total_bytes": sum(r["bytes"] for r in self._replicas.values()),
+            "databases": dict(self._replicas),
+        }
+
+
+_replica_manager = None
+
+
+def enable_db_replicas(spec, mode = DB_REPLICA.mode):
+    global _replica_manager
+    if _replica_manager is None:
+        _replica_manager = ReplicaManager(mode)
+    _replica_manager.load_all(resolve_db_names(spec))
+    return _replica_manager
+
+
+def log_db_replica_stats():
+    if _replica_manager is not None:
+        logging.info(f"数据库副本统计: {_replica_manager.stats()}")
@@ -0,0 +1,66 @@
+import os
+import time
+import sqlite3
+import hashlib
+from config import EVAL_STORE
+from utils.exec_cache import db_snapshot
+
+# 增量评测：按 (question_id, 预测 SQL 哈希, 数据库快照) 持久化每道题的评测结果，
+# 重新生成预测文件后只有 SQL 变化的题需要执行，其余直接取历史结果。
+# 同时记录 gold SQL 的哈希，dev.json 中的 gold 被修改时旧结果作废；超时的结果取决于时间预算，
+# 锁冲突、I/O 错误等临时性故障与 SQL 本身无关，都不写入，下次增量评测重新执行。
+
+
+def sql_hash(sql):
+    return hashlib.sha256((sql or "").encode("utf-8")).hexdigest()
+
+
+class EvalStore:
+    def __init__(self, path = EVAL_STORE.path):
+        self.path = path
+        self._conn = None
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok = True)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout = 30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS eval_store ("
+                "question_id TEXT NOT NULL, "
+                "pred_hash TEXT NOT NULL, "
+                "snapshot TEXT NOT NULL, "
+                "gold_hash TEXT NOT NULL, "
+                "res INTEGER NOT NULL, "
+                "created REAL NOT NULL, "
+                "PRIMARY KEY (question_id, pred_hash, snapshot))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, question_id, predicted_sql, ground_truth, db_path):
+        if not os.path.exists(db_path):
+            return None
+        row = self._connection().execute(
+            "SELECT res, gold_hash FROM eval_store WHERE question_id = ? AND pred_hash = ? AND snapshot = ?",
+            (str(question_id), sql_hash(predicted_sql), db_snapshot(db_path)),
+        ).fetchone()
+        if row is None or row[1] != sql_hash(ground_truth):
+            return None
+        return row[0]
+
+    def put_many(self, rows):
+        """
+        rows: [(question_id, 预测 SQL, gold SQL, db_path, res)]
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO eval_store (question_id, pred_hash, snapshot, gold_hash, res, created) VALUES (?, ?, ?, ?, ?, ?)",
+            [(str(qid), sql_hash(pred), db_snapshot(db_path), sql_hash(gold), res, now)
+             for qid, pred, gold, db_path, res in rows if os.path.exists(db_path)],
+        )
+        conn.commit()
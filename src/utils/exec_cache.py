@@ -0,0 +1,176 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import sqlglot
+from config import EXEC_CACHE, EXEC_STREAM
+from utils.result_fingerprint import ResultFingerprint
+
+# SQL 执行结果的磁盘缓存：key = (数据库快照, 规范化后的 SQL)
+#   - 数据库快照由文件路径、大小与修改时间确定，数据库文件变化后旧结果自动失效；
+#   - SQL 经 sqlglot 解析后重新生成，空白、关键字大小写不同的写法命中同一条；
+#   - 缓存行数、列数、预览、错误、执行耗时与结果指纹，流水线各阶段与 evaluation 共用；
+#     fingerprint 为 None 且没有错误表示结果超过行数 / 字节上限被截断。
+# 超时不缓存：是否超时取决于调用方给的时间预算。
+
+
+def normalize_sql(sql):
+    try:
+        return sqlglot.parse_one(sql, read = "sqlite").sql(dialect = "sqlite")
+    except Exception:
+        return " ".join(sql.split())
+
+
+_snapshots = {}
+
+
+def db_snapshot(db_path):
+    real_path = os.path.realpath(db_path)
+    snapshot = _snapshots.get(real_path)
+    if snapshot is None:
+        st = os.stat(real_path)
+        snapshot = f"{real_path}:{st.st_size}:{int(st.st_mtime)}"
+        _snapshots[real_path] = snapshot
+    return snapshot
+
+
+def row_size(row):
+    # 粗略估计一行占用的内存：字符串 / 二进制按长度，其余按 8 字节
+    return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in row)
+
+
+def stream_entry(cursor, start_time, max_rows = EXEC_STREAM.max_rows, max_bytes = EXEC_STREAM.max_bytes):
+    """
+    用 fetchmany 流式读取已 execute 的 cursor，只保留预览、行数与增量指纹（去重后每行一个摘要），不保留行本身。
+    超过 max_rows / max_bytes 时停止读取：row_count 为已读行数，fingerprint 为 None 表示结果被截断
+    """
+    preview = []
+    row_count = 0
+    column_count = len(cursor.description) if cursor.description else 0
+    total_bytes = 0
+    fingerprint = ResultFingerprint()
+    truncated = False
+    while not truncated:
+        rows = cursor.fetchmany(EXEC_STREAM.fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            if len(preview) < 5:
+                preview.append(row)
+            row_count += 1
+            total_bytes += row_size(row)
+            fingerprint.add(row)
+            if (max_rows is not None and row_count >= max_rows) or (max_bytes is not None and total_bytes >= max_bytes):
+                truncated = True
+                break
+    return {
+        "row_count": row_count,
+        # 空结果的列数记为 0，与原先按首行取列数的行为一致
+        "column_count": column_count if row_count else 0,
+        "preview": str(preview),
+        "error": None,
+        "exec_time": time.time() - start_time,
+        "fingerprint": None if truncated else fingerprint.hexdigest(),
+    }
+
+
+def make_error_entry(error, exec_time):
+    return {"row_count": 0, "column_count": 0, "preview": "", "error": error, "exec_time": exec_time, "fingerprint": None}
+
+
+def make_result(row_count, column_count, result, exec_time, fingerprint = None):
+    # utils.util.execute_sql_detail 的返回格式，result 为预览或带前缀的错误信息
+    return {"row_count": row_count, "column_count": column_count, "result": result, "exec_time": exec_time, "fingerprint": fingerprint}
+
+
+class ExecCache:
+    FIELDS = ["row_count", "column_count", "preview", "error", "exec_time", "fingerprint"]
+
+    def __init__(self, path = EXEC_CACHE.path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok = True)
+
+    def _connection(self):
+        # evaluation 会 fork 出进程池，SQLite 连接不能跨进程使用，按进程惰性打开
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread = False, timeout = 30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS exec_cache ("
+                "key TEXT PRIMARY KEY, "
+                "row_count INTEGER, "
+                "column_count INTEGER, "
+                "preview TEXT, "
+                "error TEXT, "
+                "exec_time REAL, "
+                "fingerprint TEXT, "
+                "created REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def make_key(self, db_path, sql):
+        payload = db_snapshot(db_path) + "\n" + normalize_sql(sql)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, db_path, sql):
+        key = self.make_key(db_path, sql)
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM exec_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(zip(self.FIELDS, row))
+
+    def put(self, db_path, sql, entry):
+        key = self.make_key(db_path, sql)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO exec_cache (key, {', '.join(self.FIELDS)}, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, *[entry[f] for f in self.FIELDS], time.time()),
+            )
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_exec_cache = None
+
+
+def enable_exec_cache(path = EXEC_CACHE.path):
+    global _exec_cache
+    if _exec_cache is None:
+        _exec_cache = ExecCache(path)
+        logging.info(f"SQL 执行结果缓存已启用: {path}")
+    return _exec_cache
+
+
+def get_exec_cache():
+    return _exec_cache
+
+
+def log_exec_cache_stats():
+    if _exec_cache is not None:
+        logging.info(f"SQL 执行结果缓存统计: {_exec_cache.stats()}")
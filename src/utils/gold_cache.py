@@ -0,0 +1,21 @@
+import logging
+from config import GOLD_CACHE
+from utils.exec_cache import ExecCache
+
+# evaluation 的 gold SQL 结果缓存：与执行结果缓存同样按 (数据库快照, 规范化 SQL) 存储完整结果的指纹，
+# 但单独存放、不受流水线行数上限影响。评测开始前预先算好全部 gold，之后每次评测只执行预测 SQL。
+
+
+_gold_cache = None
+
+
+def enable_gold_cache(path = GOLD_CACHE.path):
+    global _gold_cache
+    if _gold_cache is None:
+        _gold_cache = ExecCache(path)
+        logging.info(f"gold SQL 结果缓存已启用: {path}")
+    return _gold_cache
+
+
+def get_gold_cache():
+    return _gold_cache
@@ -0,0 +1,89 @@
+import json
+import threading
+
+# 流式响应的增量 JSON 检测器：逐段喂入模型输出，一旦出现一个完整且可解析、
+# 并包含目标字段（如 "sql"）的 JSON 对象就立即返回，调用方据此提前关闭流，
+# 不再等待模型输出答案之后的多余内容。
+
+
+class JsonAnswerDetector:
+    def __init__(self, answer_key = None):
+        self.answer_key = answer_key
+        self.text = ""
+        self.answer = None
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        """
+        追加一段输出，返回已完整的答案 JSON 字符串；尚未完整时返回 None
+        """
+        if self.answer is not None:
+            return self.answer
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            if self._start == -1:
+                if ch == "{":
+                    self._start = self._pos
+                    self._depth = 1
+                    self._in_string = False
+                    self._escape = False
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = text[self._start:self._pos + 1]
+                    if self._accept(candidate):
+                        self.answer = candidate
+                        # 截掉答案之后的内容，返回给调用方的文本以答案结尾
+                        self.text = text[:self._pos + 1]
+                        return candidate
+                    # 不是答案（例如推理过程中的花括号），从下一个字符重新寻找 '{'
+                    self._pos = self._start
+                    self._start = -1
+            self._pos += 1
+        return None
+
+    def _accept(self, candidate):
+        try:
+            obj = json.loads(candidate)
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(obj, dict):
+            return False
+        return self.answer_key is None or self.answer_key in obj
+
+
+class StreamStats:
+    def __init__(self):
+        self.streams = 0
+        self.early_stops = 0
+        self._lock = threading.Lock()
+
+    def record(self, early_stop):
+        with self._lock:
+            self.streams += 1
+            if early_stop:
+                self.early_stops += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"streams": self.streams, "early_stops": self.early_stops}
+
+
+stream_stats = StreamStats()
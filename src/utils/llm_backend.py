@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from config import LLM_BACKEND
+
+# QWEN_LLM 背后可插拔的 LLM 后端：
+#   openai : 实时请求 config.QWEN 配置的端点（默认）
+#   record : 实时请求，同时把每次成功的回复追加写入录制文件
+#   replay : 完全离线，按请求 key 从录制文件回放，可叠加合成延迟分布，
+#            用于在没有 LLM 端点的机器上确定性地压测检索、SQL 执行、prompt 构造等环节
+# 新后端通过 register_backend(name, cls) 注册后即可用 --llm_backend 选择。
+
+
+class LLMBackend:
+    # replays=True 的后端自己产生回复，QWEN_LLM 不再发起网络请求
+    replays = False
+
+    def complete(self, key, messages, response_format = None, send = None):
+        """
+        返回回复文本；send 为 QWEN_LLM 发起实时请求（含重试、降级与对冲）的驱动函数
+        """
+        raise NotImplementedError
+
+    async def acomplete(self, key, messages, response_format = None, send = None):
+        raise NotImplementedError
+
+    def observe(self, key, messages, response_format, content, latency):
+        """
+        一次实时请求成功后的回调
+        """
+        pass
+
+    def stats(self):
+        return {}
+
+
+class OpenAIBackend(LLMBackend):
+    def complete(self, key, messages, response_format = None, send = None):
+        return send()
+
+    async def acomplete(self, key, messages, response_format = None, send = None):
+        return await send()
+
+
+class RecordBackend(OpenAIBackend):
+    def __init__(self, path = LLM_BACKEND.recording_path, **kwargs):
+        self.path = path
+        self.recorded = 0
+        self._lock = threading.Lock()
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok = True)
+
+    def observe(self, key, messages, response_format, content, latency):
+        record = {
+            "key": key,
+            "messages": messages,
+            "response_format": response_format,
+            "content": content,
+            "latency": round(latency, 4),
+        }
+        line = json.dumps(record, ensure_ascii = False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding = "utf-8") as f:
+                f.write(line)
+            self.recorded += 1
+
+    def stats(self):
+        with self._lock:
+            return {"recorded": self.recorded, "path": self.path}
+
+
+def parse_latency_spec(spec):
+    """
+    合成延迟分布：none / recorded / fixed:秒 / uniform:下限,上限 / lognormal:mu,sigma（对数秒）
+    """
+    name, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    expected = {"none": 0, "recorded": 0, "fixed": 1, "uniform": 2, "lognormal": 2}
+    if name not in expected or len(values) != expected[name]:
+        raise ValueError(f"无法识别的延迟分布: {spec}")
+    return name, values
+
+
+class ReplayBackend(LLMBackend):
+    replays = True
+
+    def __init__(self, path = LLM_BACKEND.recording_path, latency = LLM_BACKEND.replay_latency,
+                 seed = LLM_BACKEND.seed, **kwargs):
+        self.path = path
+        self.latency, self.latency_params = parse_latency_spec(latency)
+        self.seed = seed
+        self.hits = 0
+        self.misses = 0
+        self.simulated_latency = 0.0
+        self._lock = threading.Lock()
+        self._records = {}
+        with open(path, "r", encoding = "utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    self._records[record["key"]] = record
+        logging.info(f"已加载 {len(self._records)} 条 LLM 录制回复: {path}")
+
+    def _delay(self, key, record):
+        if self.latency == "none":
+            return 0.0
+        if self.latency == "recorded":
+            return record.get("latency", 0.0)
+        # 以请求 key 作为随机种子，多线程下同一请求每次回放的延迟也相同
+        rng = random.Random(f"{self.seed}:{key}")
+        if self.latency == "fixed":
+            return self.latency_params[0]
+        if self.latency == "uniform":
+            return rng.uniform(*self.latency_params)
+        return rng.lognormvariate(*self.latency_params)
+
+    def lookup(self, key):
+        """
+        返回 (回复文本, 延迟)，未录制过的请求返回 (None, 0)
+        """
+        record = self._records.get(key)
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                logging.warning(f"回放模式下未找到录制的回复: {key}")
+                return None, 0.0
+            self.hits += 1
+            delay = self._delay(key, record)
+            self.simulated_latency += delay
+        return record["content"], delay
+
+    def complete(self, key, messages, response_format = None, send = None):
+        content, delay = self.lookup(key)
+        time.sleep(delay)
+        return content
+
+    async def acomplete(self, key, messages, response_format = None, send = None):
+        content, delay = self.lookup(key)
+        await asyncio.sleep(delay)
+        return content
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "simulated_latency": round(self.simulated_latency, 3),
+            }
+
+
+_BACKENDS = {
+    "openai": OpenAIBackend,
+    "record": RecordBackend,
+    "replay": ReplayBackend,
+}
+
+_backend = OpenAIBackend()
+
+
+def register_backend(name, cls):
+    _BACKENDS[name] = cls
+
+
+def available_backends():
+    return sorted(_BACKENDS)
+
+
+def configure_llm_backend(name, **kwargs):
+    global _backend
+    if name not in _BACKENDS:
+        raise ValueError(f"未注册的 LLM 后端: {name}，可选: {available_backends()}")
+    _backend = _BACKENDS[name](**kwargs)
+    logging.info(f"LLM 后端: {name}")
+    return _backend
+
+
+def get_llm_backend():
+    return _backend
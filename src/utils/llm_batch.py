@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import uuid
+import logging
+import concurrent.futures
+from types import SimpleNamespace
+from tqdm import tqdm
+from config import LLM_BATCH
+from utils.llm_cache import get_llm_cache, enable_llm_cache
+
+# 离线批量提交模式（OpenAI 兼容的 /v1/batches 接口）：
+#   每一轮把所有条目跑一遍 process_item，遇到缓存未命中的 LLM 调用时记录请求并中断该条目；
+#   收集到的请求写成 batch JSONL 提交、轮询，结果按 custom_id 写回 LLM 缓存，
+#   下一轮重跑未完成的条目，已完成的调用直接命中缓存。
+#   多轮调用的阶段（如阶段 4 的修复链）每轮推进一步，直到没有新的请求为止。
+
+
+class PendingLLMCall(BaseException):
+    """
+    批量收集模式下缓存未命中时抛出。继承 BaseException，
+    避免被各阶段里的 except Exception 吞掉后继续用空结果往下跑
+    """
+    def __init__(self, cache_key, body):
+        super().__init__(cache_key)
+        self.cache_key = cache_key
+        self.body = body
+
+
+_collecting = False
+# batch 输入文件所在目录，由 --llm_batch_dir 配置
+_workdir = LLM_BATCH.workdir
+
+
+def is_collecting():
+    return _collecting
+
+
+def configure_llm_batch(workdir):
+    global _workdir
+    _workdir = workdir
+
+
+def build_batch_line(custom_id, body):
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+
+def parse_batch_output(text):
+    """
+    解析 batch 输出文件，返回 {custom_id: content}，失败的请求不在结果中
+    """
+    results = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            logging.warning(f"batch 请求失败: {record.get('custom_id')} {record.get('error')}")
+            continue
+        content = response["body"]["choices"][0]["message"]["content"]
+        if content is not None:
+            results[record["custom_id"]] = content
+    return results
+
+
+class LocalBatchClient:
+    """
+    基于本地文件的 batch 服务替身，接口与 openai.OpenAI 的 files / batches 一致，
+    responder(body) 返回该请求的回复文本，用于离线测试整条批量流程
+    """
+    def __init__(self, workdir = LLM_BATCH.workdir, responder = None):
+        self.workdir = os.path.join(workdir, "local_server")
+        os.makedirs(self.workdir, exist_ok = True)
+        self.responder = responder or (lambda body: "{}")
+        self._batches = {}
+        self.files = SimpleNamespace(create = self._create_file, content = self._file_content)
+        self.batches = SimpleNamespace(create = self._create_batch, retrieve = self._retrieve_batch)
+
+    def _create_file(self, file, purpose):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with open(os.path.join(self.workdir, file_id), "wb") as f:
+            f.write(file.read())
+        return SimpleNamespace(id = file_id, purpose = purpose)
+
+    def _file_content(self, file_id):
+        with open(os.path.join(self.workdir, file_id), "r", encoding = "utf-8") as f:
+            return SimpleNamespace(text = f.read())
+
+    def _create_batch(self, input_file_id, endpoint, completion_window, **kwargs):
+        batch_id = f"batch-{uuid.uuid4().hex}"
+        output_lines = []
+        with open(os.path.join(self.workdir, input_file_id), "r", encoding = "utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                content = self.responder(request["body"])
+                output_lines.append(json.dumps({
+                    "id": f"req-{uuid.uuid4().hex}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}},
+                    "error": None,
+                }, ensure_ascii = False))
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        with open(os.path.join(self.workdir, output_file_id), "w", encoding = "utf-8") as f:
+            f.write("\n".join(output_lines) + "\n")
+        self._batches[batch_id] = SimpleNamespace(id = batch_id, status = "completed",
+                                                  output_file_id = output_file_id, error_file_id = None)
+        return self._batches[batch_id]
+
+    def _retrieve_batch(self, batch_id):
+        return self._batches[batch_id]
+
+
+def submit_and_wait(client, requests, round_index, workdir = LLM_BATCH.workdir, poll_interval = LLM_BATCH.poll_interval):
+    """
+    写 batch JSONL、提交并轮询到结束，返回 {custom_id: content}
+    """
+    os.makedirs(workdir, exist_ok = True)
+    input_path = os.path.join(workdir, f"batch_input_{int(time.time())}_{round_index}.jsonl")
+    with open(input_path, "w", encoding = "utf-8") as f:
+        for custom_id, body in requests.items():
+            f.write(json.dumps(build_batch_line(custom_id, body), ensure_ascii = False) + "\n")
+
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file = f, purpose = "batch")
+    batch = client.batches.create(input_file_id = input_file.id, endpoint = "/v1/chat/completions",
+                                  completion_window = LLM_BATCH.completion_window)
+    logging.info(f"已提交 batch {batch.id}，请求数 {len(requests)}，输入文件 {input_path}")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        logging.info(f"batch {batch.id} 状态: {batch.status}")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        logging.error(f"batch {batch.id} 未完成: {batch.status}")
+        return {}
+    return parse_batch_output(client.files.content(batch.output_file_id).text)
+
+
+def run_stage_batch(items, process_item, output_file, client, max_workers = 8, max_rounds = LLM_BATCH.max_rounds,
+                    workdir = None):
+    """
+    以批量模式运行一个阶段，最终结果按 items 的原始顺序写入 output_file；workdir 缺省时使用 --llm_batch_dir
+    """
+    global _collecting
+    cache = get_llm_cache() or enable_llm_cache()
+    workdir = workdir or _workdir
+    results = {}
+    pending = list(enumerate(items))
+
+    _collecting = True
+    try:
+        for round_index in range(max_rounds):
+            requests = {}
+            still_pending = []
+            with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+                futures = {executor.submit(process_item, item): (idx, item) for idx, item in pending}
+                for future in tqdm(concurrent.futures.as_completed(futures), total = len(futures),
+                                   desc = f"Batch round {round_index + 1}"):
+                    idx, item = futures[future]
+                    try:
+                        results[idx] = future.result()
+                    except PendingLLMCall as call:
+                        requests[f"{item.get('question_id', idx)}:{call.cache_key}"] = call.body
+                        still_pending.append((idx, item))
+                    except Exception as e:
+                        logging.error(f"处理 item 时异常: {e}")
+
+            if not requests:
+                break
+            logging.info(f"第 {round_index + 1} 轮: {len(still_pending)} 个条目等待 {len(requests)} 个 LLM 请求")
+            responses = submit_and_wait(client, requests, round_index, workdir)
+            for custom_id, content in responses.items():
+                cache.put(custom_id.split(":", 1)[1], content)
+            if not responses:
+                logging.error("batch 没有返回任何结果，终止")
+                break
+            pending = still_pending
+        else:
+            logging.warning(f"达到最大轮数 {max_rounds}，仍有 {len(pending)} 个条目未完成")
+    finally:
+        _collecting = False
+
+    with open(output_file, "w", encoding = "utf-8") as out_f:
+        for idx in sorted(results):
+            if results[idx]:
+                out_f.write(json.dumps(results[idx], ensure_ascii = False) + "\n")
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config import LLM_CACHE
+
+# 基于 SQLite 的 LLM 响应缓存：
+#   key   = sha256(model + messages + 采样参数)
+#   value = LLM 返回的文本
+# temperature=0 时同一组输入的输出是确定的，重复运行流水线可以直接命中缓存。
+
+
+def make_cache_key(model, messages, **params):
+    """
+    根据模型名、消息列表和采样参数生成内容寻址的缓存 key
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path = LLM_CACHE.path, max_bytes = LLM_CACHE.max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok = True)
+        # 各阶段都是多线程调用，连接在线程间共享，由 self._lock 串行化
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        if response is None:
+            return
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # 超出容量时按最近访问时间（LRU）淘汰
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM llm_cache ORDER BY accessed ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "bytes": self._total_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 进程级单例，默认关闭，由各阶段的 --llm-cache 开关启用
+_llm_cache = None
+
+
+def enable_llm_cache(path = LLM_CACHE.path, max_bytes = LLM_CACHE.max_bytes):
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache(path, max_bytes)
+        logging.info(f"LLM 缓存已启用: {path}")
+    return _llm_cache
+
+
+def get_llm_cache():
+    return _llm_cache
+
+
+def log_llm_cache_stats():
+    if _llm_cache is not None:
+        logging.info(f"LLM 缓存统计: {_llm_cache.stats()}")
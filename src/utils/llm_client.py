@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import threading
+import importlib.util
+import httpx
+import openai
+from config import QWEN, LLM_CLIENT
+
+# 进程级 OpenAI 客户端注册表：所有 QWEN_LLM / AsyncQWEN_LLM 实例共享同一个 httpx 连接池，
+# 复用 keep-alive 连接（安装了 h2 时走 HTTP/2 多路复用），避免每次调用都重新做 TCP/TLS 握手。
+
+_lock = threading.Lock()
+_pool_size = LLM_CLIENT.pool_size
+_sync_client = None
+_async_clients = {}  # 事件循环 -> AsyncOpenAI，httpx.AsyncClient 不能跨事件循环使用
+
+
+class ConnectionStats:
+    """
+    通过响应里的 network_stream 识别底层连接，统计新建连接数与复用次数
+    """
+    def __init__(self):
+        self.requests = 0
+        self._streams = set()
+        self._lock = threading.Lock()
+
+    def observe(self, response):
+        stream = response.extensions.get("network_stream")
+        with self._lock:
+            self.requests += 1
+            if stream is not None:
+                self._streams.add(id(stream))
+
+    def snapshot(self):
+        with self._lock:
+            opened = len(self._streams)
+            return {
+                "requests": self.requests,
+                "connections_opened": opened,
+                "connections_reused": max(0, self.requests - opened),
+                "reuse_rate": (self.requests - opened) / self.requests if self.requests else 0.0,
+            }
+
+
+connection_stats = ConnectionStats()
+
+
+def http2_available():
+    return LLM_CLIENT.http2 and importlib.util.find_spec("h2") is not None
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections = _pool_size,
+        max_keepalive_connections = _pool_size,
+        keepalive_expiry = LLM_CLIENT.keepalive_expiry,
+    )
+
+
+def configure_llm_client(pool_size):
+    """
+    设置连接池大小，需在第一次创建客户端之前调用（一般与阶段的并发数保持一致）
+    """
+    global _pool_size
+    with _lock:
+        if _sync_client is not None or _async_clients:
+            logging.warning("LLM 客户端已创建，新的连接池大小不会生效")
+            return
+        _pool_size = pool_size
+
+
+def get_openai_client():
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            http_client = httpx.Client(
+                limits = _limits(),
+                http2 = http2_available(),
+                timeout = LLM_CLIENT.timeout,
+                event_hooks = {"response": [connection_stats.observe]},
+            )
+            # 重试与退避统一由 AdaptiveLimiter 控制，关闭 SDK 自带的重试
+            _sync_client = openai.OpenAI(api_key = QWEN.api, base_url = QWEN.base_url,
+                                         max_retries = 0, http_client = http_client)
+        return _sync_client
+
+
+def get_async_openai_client():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            async def _observe(response):
+                connection_stats.observe(response)
+
+            http_client = httpx.AsyncClient(
+                limits = _limits(),
+                http2 = http2_available(),
+                timeout = LLM_CLIENT.timeout,
+                event_hooks = {"response": [_observe]},
+            )
+            client = openai.AsyncOpenAI(api_key = QWEN.api, base_url = QWEN.base_url,
+                                        max_retries = 0, http_client = http_client)
+            # 清理已关闭事件循环遗留的客户端
+            for old_loop in [l for l in _async_clients if l.is_closed()]:
+                del _async_clients[old_loop]
+            _async_clients[loop] = client
+        return client
+
+
+def get_connection_stats():
+    stats = connection_stats.snapshot()
+    stats["pool_size"] = _pool_size
+    stats["http2"] = http2_available()
+    return stats
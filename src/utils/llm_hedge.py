@@ -0,0 +1,170 @@
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+from config import LLM_HEDGE
+
+# 对冲请求（hedged request）：一次 LLM 调用的耗时超过在线学习到的延迟分位数时，
+# 再发出一份相同的请求，取先返回的结果并取消另一份，用少量额外请求削掉尾延迟。
+#   - 阈值取最近 window 次单请求延迟的 percentile 分位数，样本不足 min_samples 时不对冲；
+#   - 对冲请求数占比不超过 max_hedge_rate，避免服务端整体变慢时对冲请求反过来放大负载；
+#   - 同步调用中被取消的一方：流式请求会立即关闭连接，非流式请求无法中断，只能在后台跑完后丢弃。
+
+
+class HedgePolicy:
+    def __init__(self,
+                 percentile = LLM_HEDGE.percentile,
+                 window = LLM_HEDGE.window,
+                 min_samples = LLM_HEDGE.min_samples,
+                 min_delay = LLM_HEDGE.min_delay,
+                 max_hedge_rate = LLM_HEDGE.max_hedge_rate):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_hedge_rate = max_hedge_rate
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+        self._latencies = deque(maxlen = window)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def threshold(self):
+        """
+        当前的对冲阈值（秒）；样本不足或超出对冲预算时返回 None
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            if self.calls and self.hedged / self.calls >= self.max_hedge_rate:
+                return None
+            ordered = sorted(self._latencies)
+            value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+            return max(self.min_delay, value)
+
+    def _observe(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _record(self, hedged, hedge_won, elapsed):
+        with self._lock:
+            self.calls += 1
+            if hedged:
+                self.hedged += 1
+            if hedge_won:
+                self.hedge_wins += 1
+                # 原请求被取消，其真实耗时未知：用窗口中超过当前耗时的延迟均值估计原请求本来还要等多久
+                slower = [l for l in self._latencies if l > elapsed]
+                if slower:
+                    self.latency_saved += sum(slower) / len(slower) - elapsed
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix = "llm-hedge")
+            return self._executor
+
+    def run(self, fn):
+        """
+        同步调用 fn(cancel)，cancel 为 threading.Event，被置位时 fn 应尽快放弃
+        """
+        threshold = self.threshold()
+        start = time.time()
+        if threshold is None:
+            result = fn(threading.Event())
+            self._observe(time.time() - start)
+            self._record(False, False, time.time() - start)
+            return result
+
+        executor = self._get_executor()
+        cancels = [threading.Event(), threading.Event()]
+        primary = executor.submit(fn, cancels[0])
+        done, _ = concurrent.futures.wait([primary], timeout = threshold)
+        if done:
+            self._observe(time.time() - start)
+            self._record(False, False, time.time() - start)
+            return primary.result()
+
+        hedge_start = time.time()
+        hedge = executor.submit(fn, cancels[1])
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                winner = future
+                loser = hedge if winner is primary else primary
+                cancels[1 if loser is hedge else 0].set()
+                now = time.time()
+                self._observe(now - hedge_start if winner is hedge else now - start)
+                self._record(True, winner is hedge, now - start)
+                return winner.result()
+        # 两份请求都失败，交给调用方的重试逻辑
+        self._record(True, False, time.time() - start)
+        raise error
+
+    async def run_async(self, make_coro):
+        """
+        协程版本：make_coro() 每次返回一个新的请求协程，输掉的一方会被 cancel
+        """
+        threshold = self.threshold()
+        start = time.time()
+        primary = asyncio.ensure_future(make_coro())
+        done, _ = await asyncio.wait({primary}, timeout = threshold)
+        if done:
+            self._observe(time.time() - start)
+            self._record(False, False, time.time() - start)
+            return primary.result()
+
+        hedge_start = time.time()
+        hedge = asyncio.ensure_future(make_coro())
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    now = time.time()
+                    self._observe(now - hedge_start if task is hedge else now - start)
+                    self._record(True, task is hedge, now - start)
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        self._record(True, False, time.time() - start)
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "latency_saved": round(self.latency_saved, 3),
+            }
+
+
+_hedge_policy = None
+
+
+def enable_hedging(percentile = LLM_HEDGE.percentile):
+    global _hedge_policy
+    if _hedge_policy is None:
+        _hedge_policy = HedgePolicy(percentile = percentile)
+        logging.info(f"LLM 对冲请求已启用，阈值分位数 p{int(percentile * 100)}")
+    return _hedge_policy
+
+
+def get_hedge_policy():
+    return _hedge_policy
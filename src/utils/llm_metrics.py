@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from config import LLM_METRICS
+
+# LLM 调用的 token 与延迟记账：每次调用按 阶段 / 调用点 / question_id 打标签，
+# 逐行写入 metrics JSONL，由 src/llm_metrics_report.py 汇总各阶段的延迟分位数、token 与费用。
+# question_id 通过 contextvars 传递：线程池里每个任务、asyncio 里每个 Task 各自独立。
+
+_question_id = contextvars.ContextVar("llm_question_id", default = None)
+
+
+def track_question(func):
+    """
+    装饰 process_item / process_item_async，把 item 的 question_id 绑定到其中的所有 LLM 调用
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(item, *args, **kwargs):
+            token = _question_id.set(item.get("question_id") if isinstance(item, dict) else None)
+            try:
+                return await func(item, *args, **kwargs)
+            finally:
+                _question_id.reset(token)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(item, *args, **kwargs):
+        token = _question_id.set(item.get("question_id") if isinstance(item, dict) else None)
+        try:
+            return func(item, *args, **kwargs)
+        finally:
+            _question_id.reset(token)
+    return wrapper
+
+
+def usage_of(response):
+    """
+    从 chat.completions 响应中取出 token 用量，服务端未返回时为 None
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+class LLMMetrics:
+    def __init__(self, path = LLM_METRICS.path, stage = None):
+        self.path = path
+        self.stage = stage
+        self._lock = threading.Lock()
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok = True)
+        self._file = open(path, "a", encoding = "utf-8")
+
+    def record(self, call_site, status, latency, usage = None, retries = 0):
+        """
+        status: ok / failed / cached / replayed
+        """
+        record = {
+            "ts": round(time.time(), 3),
+            "stage": self.stage,
+            "call_site": call_site,
+            "question_id": _question_id.get(),
+            "status": status,
+            "latency": round(latency, 4),
+            "retries": retries,
+            "prompt_tokens": usage["prompt_tokens"] if usage else None,
+            "completion_tokens": usage["completion_tokens"] if usage else None,
+        }
+        line = json.dumps(record, ensure_ascii = False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+
+_llm_metrics = None
+
+
+def enable_llm_metrics(path = LLM_METRICS.path, stage = None):
+    global _llm_metrics
+    if _llm_metrics is None:
+        _llm_metrics = LLMMetrics(path, stage)
+        logging.info(f"LLM 调用记账已启用: {path}，阶段 {stage}")
+    return _llm_metrics
+
+
+def record_llm_call(call_site, status, latency, usage = None, retries = 0):
+    if _llm_metrics is not None:
+        _llm_metrics.record(call_site, status, latency, usage, retries)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def summarize(records, group_keys, prompt_price = LLM_METRICS.prompt_price, completion_price = LLM_METRICS.completion_price):
+    """
+    按 group_keys 分组汇总，返回 {分组: 统计}；缓存命中与回放不计延迟分位数和费用
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(tuple(record.get(k) for k in group_keys), []).append(record)
+
+    summary = {}
+    for key, rows in sorted(groups.items(), key = lambda kv: [str(k) for k in kv[0]]):
+        live = [r for r in rows if r["status"] in ("ok", "failed")]
+        latencies = [r["latency"] for r in live if r["status"] == "ok"]
+        prompt_tokens = sum(r["prompt_tokens"] or 0 for r in live)
+        completion_tokens = sum(r["completion_tokens"] or 0 for r in live)
+        summary[key] = {
+            "calls": len(rows),
+            "cached": sum(1 for r in rows if r["status"] in ("cached", "replayed")),
+            "failed": sum(1 for r in rows if r["status"] == "failed"),
+            "retries": sum(r["retries"] for r in rows),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "no_usage": sum(1 for r in live if r["prompt_tokens"] is None),
+            "cost": (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000,
+        }
+    return summary
@@ -0,0 +1,201 @@
+import re
+import json
+import logging
+import threading
+from utils.json_stream import JsonAnswerDetector
+
+# 各阶段共用的 LLM 回复解析层：
+#   1. 结构化输出：向兼容 OpenAI 的服务端请求 response_format（json_schema / json_object），
+#      服务端不支持时自动降级；
+#   2. 解析：直接 json.loads -> 增量扫描第一个完整答案对象 -> extract_json 启发式修复；
+#   3. 统计各调用点的解析失败率。
+
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+
+def answer_schema_format(answer_key):
+    """
+    只含一个字符串字段（如 {"sql": "..."}）的 json_schema 约束
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{answer_key}_answer",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {answer_key: {"type": "string"}},
+                "required": [answer_key],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+class StructuredOutput:
+    """
+    记录服务端支持到哪一级结构化输出：json_schema -> json_object -> 不支持
+    """
+    LEVELS = ["json_schema", "json_object", None]
+
+    def __init__(self):
+        self.enabled = False
+        self.level = "json_schema"
+        self._lock = threading.Lock()
+
+    def format_for(self, answer_key = None, response_format = None):
+        if not self.enabled or self.level is None:
+            return None
+        if response_format is None:
+            if answer_key is None:
+                return None
+            response_format = answer_schema_format(answer_key)
+        if response_format["type"] == "json_schema" and self.level != "json_schema":
+            return JSON_OBJECT_FORMAT
+        return response_format
+
+    def downgrade(self, response_format):
+        """
+        按实际发送且被拒绝的格式降级：json_schema 被拒降到 json_object，json_object 被拒则不再请求结构化输出
+        """
+        with self._lock:
+            # 级别只降不升；并发请求已降到更低级别时保持不变
+            target = self.LEVELS.index(response_format["type"]) + 1
+            if target > self.LEVELS.index(self.level):
+                self.level = self.LEVELS[target]
+                logging.warning(f"服务端不支持 response_format={response_format['type']}，降级为 {self.level}")
+
+
+structured_output = StructuredOutput()
+
+
+def is_response_format_error(e):
+    """
+    服务端因 response_format 不受支持而返回的 400 错误
+    """
+    return getattr(e, "status_code", None) == 400 and "response_format" in str(e)
+
+
+def extract_json(message):
+    """
+    尝试从 LLM 返回中提取 JSON 对象：
+    1. 优先匹配 ```json { ... } ``` 代码块；
+    2. 如果没有，再找第一个 '{' 和最后一个 '}' 之间的内容；
+    3. 如果都失败，就原样返回。
+
+    并且：
+      - 如果提取到的字符串在闭合 '}' 前是 '";'，则把它替换为 '"}'
+      - 否则，若在闭合 '}' 前缺少 '"'，再自动补上一个
+    """
+    def _cleanup(json_str: str) -> str:
+        # —— 新增：如果闭合 } 前是 '";'，替换成 '"}'
+        json_str = re.sub(r'";\s*}$', '"}', json_str)
+
+        # —— 原有：补齐缺失的双引号
+        if not json_str.endswith('}'):
+            return json_str
+
+        # 跳过 '}' 之前所有空白，找到最后一个非空白字符
+        i = len(json_str) - 2
+        while i >= 0 and json_str[i].isspace():
+            i -= 1
+
+        # 如果它不是 '"'，就在它后面插入一个
+        if i >= 0 and json_str[i] != '"':
+            insert_pos = i + 1
+            json_str = json_str[:insert_pos] + '"' + json_str[insert_pos:]
+
+        return json_str
+
+    # 1. 尝试 ```json … ``` 代码块
+    try:
+        match = re.search(r"```json\s*(\{.*?\})\s*```", message, re.DOTALL)
+        if match:
+            return _cleanup(match.group(1))
+    except Exception as e:
+        logging.error(f"Error extracting JSON with regex: {e}")
+
+    # 2. 尝试最简单的 { … } 截取
+    try:
+        start = message.find("{")
+        end   = message.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            candidate = message[start:end + 1]
+            return _cleanup(candidate)
+        else:
+            logging.warning("未找到有效 JSON 区间，直接返回原始消息")
+            return message
+    except Exception as e:
+        logging.error(f"Error extracting JSON using find: {e}")
+        return message
+
+
+class ParseStats:
+    def __init__(self):
+        self.by_site = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, method):
+        with self._lock:
+            # method: direct / incremental / repaired / failed
+            site = self.by_site.setdefault(name or "unknown", {"total": 0, "failed": 0})
+            site["total"] += 1
+            site[method] = site.get(method, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, site in self.by_site.items():
+                result[name] = dict(site)
+                result[name]["failure_rate"] = site["failed"] / site["total"] if site["total"] else 0.0
+            return result
+
+
+parse_stats = ParseStats()
+
+
+def parse_json_response(response, answer_key = None, name = None):
+    """
+    解析 LLM 回复中的 JSON 对象，失败返回 None；name 为调用点，用于统计与日志
+    """
+    if response is None:
+        parse_stats.record(name, "failed")
+        return None
+
+    # 1. 结构化输出下回复本身就是 JSON
+    try:
+        obj = json.loads(response.strip())
+        if isinstance(obj, dict) and (answer_key is None or answer_key in obj):
+            parse_stats.record(name, "direct")
+            return obj
+    except json.JSONDecodeError:
+        pass
+
+    # 2. 增量扫描：取第一个完整、可解析且含 answer_key 的对象
+    answer = JsonAnswerDetector(answer_key).feed(response)
+    if answer is not None:
+        parse_stats.record(name, "incremental")
+        return json.loads(answer)
+
+    # 3. 启发式修复（补引号、去掉多余分号等）
+    try:
+        obj = json.loads(extract_json(response))
+        if isinstance(obj, dict):
+            parse_stats.record(name, "repaired")
+            return obj
+    except json.JSONDecodeError:
+        pass
+
+    parse_stats.record(name, "failed")
+    logging.warning(f"{name} 无法解析 LLM 返回的 JSON" + f"\n{response}")
+    return None
+
+
+def parse_sql_response(response, name = None):
+    """
+    解析 {"sql": "..."} 形式的回复，失败返回空字符串
+    """
+    obj = parse_json_response(response, "sql", name)
+    if obj is None:
+        return ""
+    return obj.get("sql", "")
@@ -0,0 +1,183 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from config import LLM_THROTTLE
+
+# 进程级 AIMD 并发控制器：
+#   - 成功且延迟正常：在途上限加性增长（每个窗口 +1）
+#   - 429 / 5xx / 延迟明显劣化：在途上限乘性收缩；延迟基线取最近 latency_window 次成功请求的平滑延迟最小值，
+#     一段偶然的低延迟期过去后基线会回升，不会把上限永久压低
+#   - 重试间隔使用带抖动的指数退避，服务端给出 Retry-After 时以其为下限
+
+
+def is_throttle_error(e):
+    """
+    判断异常是否属于限流 / 服务端过载（429、5xx、超时）
+    """
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(e).__name__ in ("APITimeoutError", "APIConnectionError", "RateLimitError")
+
+
+def get_retry_after(e):
+    """
+    从异常携带的 HTTP 响应中解析 Retry-After（秒），不存在则返回 None
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    def __init__(self,
+                 initial_limit = LLM_THROTTLE.initial_limit,
+                 min_limit = LLM_THROTTLE.min_limit,
+                 max_limit = LLM_THROTTLE.max_limit,
+                 decrease_factor = LLM_THROTTLE.decrease_factor,
+                 latency_tolerance = LLM_THROTTLE.latency_tolerance,
+                 latency_window = LLM_THROTTLE.latency_window):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.inflight = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+        self.latency_ewma = None
+        self._recent_latency = deque(maxlen = latency_window)  # 最近的平滑延迟，其最小值作为"未拥塞"基线
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # 等待名额的协程：(事件循环, future)
+
+    def _try_acquire(self):
+        if self.inflight < int(self.limit):
+            self.inflight += 1
+            return True
+        return False
+
+    def acquire(self):
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+
+    async def acquire_async(self):
+        # 协程侧不能阻塞在 Condition 上：登记一个 future，由 release 唤醒后再重新争抢名额
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_acquire():
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    def _wake_async_waiters(self):
+        # release 可能在其他线程中调用，通过 call_soon_threadsafe 回到各自的事件循环
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_waiter_done, waiter)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def release(self, latency, ok = True, throttled = False):
+        with self._cond:
+            self.inflight -= 1
+            if ok:
+                self.successes += 1
+                self._observe_latency(latency)
+                if self._latency_degraded():
+                    self._decrease()
+                else:
+                    # 加性增长：每完成约 limit 个请求，上限 +1
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self.errors += 1
+                if throttled:
+                    self.throttled += 1
+                    self._decrease()
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _observe_latency(self, latency):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+        self._recent_latency.append(self.latency_ewma)
+
+    def _latency_degraded(self):
+        if not self._recent_latency or self.successes < 10:
+            return False
+        return self.latency_ewma > min(self._recent_latency) * self.latency_tolerance
+
+    def _decrease(self):
+        # 同一批失败通常集中爆发，1 秒内只收缩一次，避免上限被瞬间打到最小
+        now = time.time()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def backoff_delay(self, attempt, retry_after = None):
+        """
+        第 attempt 次（从 1 开始）重试前的等待时间：full jitter 指数退避，Retry-After 作为下限
+        """
+        delay = random.uniform(0, min(LLM_THROTTLE.backoff_cap, LLM_THROTTLE.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after + random.uniform(0, LLM_THROTTLE.backoff_base))
+        return delay
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "successes": self.successes,
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            }
+
+
+def _set_waiter_done(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_llm_limiter = None
+_llm_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter():
+    global _llm_limiter
+    with _llm_limiter_lock:
+        if _llm_limiter is None:
+            _llm_limiter = AdaptiveLimiter()
+        return _llm_limiter
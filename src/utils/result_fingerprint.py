@@ -0,0 +1,48 @@
+import hashlib
+
+# 与顺序、重复行无关的结果集指纹：对去重后每一行的 blake2b 摘要做异或，
+# 两个结果集指纹相同等价于 evaluation 中的 set(pred) == set(gt)（忽略哈希碰撞）。
+# 数值按 Python 相等语义归一化（1 == 1.0），与 set 比较的行为一致。
+# 去重需要记住已见过的行摘要：内存随不同行数线性增长（每行 16 字节摘要，不保留行本身），
+# 调用方用行数上限（EXEC_STREAM.max_rows）约束。
+
+
+def normalize_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def row_digest(row):
+    payload = repr(tuple(normalize_value(v) for v in row)).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(payload, digest_size = 16).digest(), "big")
+
+
+class ResultFingerprint:
+    """
+    增量计算指纹，可以边 fetch 边 add，只保留去重后各行的摘要
+    """
+    def __init__(self):
+        self._seen = set()
+        self._xor = 0
+
+    def add(self, row):
+        digest = row_digest(row)
+        if digest not in self._seen:
+            self._seen.add(digest)
+            self._xor ^= digest
+
+    def update(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def hexdigest(self):
+        return f"{len(self._seen)}:{self._xor:032x}"
+
+
+def result_fingerprint(rows):
+    fingerprint = ResultFingerprint()
+    fingerprint.update(rows)
+    return fingerprint.hexdigest()
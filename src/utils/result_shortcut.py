@@ -0,0 +1,60 @@
+import logging
+import threading
+
+# 结果一致时跳过 LLM：候选 SQL 都执行成功、结果非空且结果指纹相同，说明它们给出的是同一个答案，
+# 再让 LLM 融合或二选一没有意义，直接采用其中执行最快的一条。
+# 空结果不走捷径：几条候选都查不到数据往往是同一个错误，仍交给 LLM 处理。
+
+
+class ResultShortcut:
+    def __init__(self):
+        self.checked = 0
+        self.agreed = 0
+        self.llm_calls_avoided = 0
+        self._lock = threading.Lock()
+
+    def pick(self, sqls, results, llm_calls = 1):
+        """
+        results 与 sqls 一一对应，需含 fingerprint / row_count / exec_time（出错的结果 fingerprint 为空）；
+        候选结果一致时返回执行最快的 SQL，否则返回 None。llm_calls 为走捷径时省下的 LLM 调用次数
+        """
+        fingerprints = {r.get("fingerprint") for r in results}
+        agreed = (len(results) > 0 and None not in fingerprints and len(fingerprints) == 1
+                  and results[0].get("row_count", 0) > 0)
+        with self._lock:
+            self.checked += 1
+            if agreed:
+                self.agreed += 1
+                self.llm_calls_avoided += llm_calls
+        if not agreed:
+            return None
+        fastest = min(range(len(sqls)), key = lambda i: results[i].get("exec_time", 0))
+        return sqls[fastest]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "agreed": self.agreed,
+                "llm_calls_avoided": self.llm_calls_avoided,
+            }
+
+
+_result_shortcut = None
+
+
+def enable_result_shortcut():
+    global _result_shortcut
+    if _result_shortcut is None:
+        _result_shortcut = ResultShortcut()
+        logging.info("候选结果一致时跳过 LLM 已启用")
+    return _result_shortcut
+
+
+def get_result_shortcut():
+    return _result_shortcut
+
+
+def log_result_shortcut_stats():
+    if _result_shortcut is not None:
+        logging.info(f"结果一致捷径统计: {_result_shortcut.stats()}")
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import sqlglot
+from sqlglot import exp
+from config import SQL_DEDUP
+
+# SQL 规范化与去重：
+#   - 不加引号的标识符统一小写（SQLite 的表名、列名不区分大小写）；加了引号的保持原样：
+#     SQLite 中找不到同名列的 "Paris" 会被当作字符串字面量，"Paris" 与 "PARIS" 不能合并；
+#   - 表、子查询的别名按出现顺序重命名为 t1、t2 ...，没有别名的表也补上，表名限定的列改用别名限定；
+#     CTE 重命名为 c1、c2 ...；新名字跳过仍在使用的名字，保证重命名是一一对应的，不同别名不会被并成同一个；
+#   - INNER JOIN 写作 JOIN，关键字、空白由 sqlglot 重新生成。
+# 规范化后相同的 SQL 视为同一候选：执行结果与修复判断按 (库, 指纹) / (问题, 指纹) 记忆，只做一次。
+
+
+def canonicalize_sql(sql):
+    try:
+        tree = sqlglot.parse_one(sql, read = "sqlite")
+    except Exception:
+        return " ".join(sql.split())
+    if tree is None:
+        return ""
+
+    def fresh_name(prefix, taken, assigned):
+        n = len(assigned) + 1
+        while f"{prefix}{n}" in taken:
+            n += 1
+        name = f"{prefix}{n}"
+        taken.add(name)
+        return name
+
+    # CTE 名字与真实表名在同一个命名空间，c1、c2 ... 不能与查询中的表名重名
+    ctes = {}
+    cte_keys = {cte.alias.lower() for cte in tree.find_all(exp.CTE) if cte.alias}
+    taken = {table.name.lower() for table in tree.find_all(exp.Table)} - cte_keys
+    for cte in tree.find_all(exp.CTE):
+        key = cte.alias.lower()
+        if key and key not in ctes:
+            ctes[key] = fresh_name("c", taken, ctes)
+
+    # 表与子查询的别名共用一个映射；不属于任何别名的限定名（如外层表名）保持原样，t1、t2 ... 跳过它们
+    sources = [node for node in tree.find_all(exp.Table, exp.Subquery) if isinstance(node, exp.Table) or node.alias]
+    keys = {source.alias_or_name.lower() for source in sources}
+    taken = {column.table.lower() for column in tree.find_all(exp.Column) if column.table} - keys
+    aliases = {}
+    for source in sources:
+        key = source.alias_or_name.lower()
+        if key not in aliases:
+            aliases[key] = fresh_name("t", taken, aliases)
+        alias = source.args.get("alias")
+        if alias is not None:
+            # 保留子查询别名后的列名列表
+            alias.set("this", exp.to_identifier(aliases[key]))
+        else:
+            source.set("alias", exp.TableAlias(this = exp.to_identifier(aliases[key])))
+    for column in tree.find_all(exp.Column):
+        if column.table and column.table.lower() in aliases:
+            column.set("table", exp.to_identifier(aliases[column.table.lower()]))
+    for table in tree.find_all(exp.Table):
+        if not table.db and table.name.lower() in ctes:
+            table.set("this", exp.to_identifier(ctes[table.name.lower()]))
+    for cte in tree.find_all(exp.CTE):
+        if cte.alias:
+            cte.args["alias"].set("this", exp.to_identifier(ctes[cte.alias.lower()]))
+    for join in tree.find_all(exp.Join):
+        # INNER JOIN 与 JOIN 等价
+        if (join.args.get("kind") or "").upper() == "INNER":
+            join.set("kind", None)
+    for identifier in tree.find_all(exp.Identifier):
+        if not identifier.quoted:
+            identifier.set("this", identifier.this.lower())
+    return tree.sql(dialect = "sqlite", identify = True)
+
+
+def sql_fingerprint(sql):
+    return hashlib.sha1(canonicalize_sql(sql or "").encode("utf-8")).hexdigest()[:16]
+
+
+def dedupe_candidates(sqls):
+    """
+    去掉规范化后重复的候选，保留每组中第一次出现的写法
+    """
+    seen = set()
+    unique = []
+    for sql in sqls:
+        fingerprint = sql_fingerprint(sql)
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            unique.append(sql)
+    return unique
+
+
+class CanonicalMemo:
+    """
+    进程内的 LRU 记忆表，key 中带 SQL 指纹，写法不同但规范化相同的 SQL 共用同一条
+    """
+    def __init__(self, max_entries = SQL_DEDUP.max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+_sql_dedup = None
+
+
+def dedup_lookup(scope, sql):
+    """
+    scope 区分记忆的用途与上下文，如 ("exec", 库名)、("judge", 问题)；未启用时返回 None
+    """
+    if _sql_dedup is None:
+        return None
+    return _sql_dedup.get((*scope, sql_fingerprint(sql)))
+
+
+def dedup_store(scope, sql, value):
+    if _sql_dedup is not None:
+        _sql_dedup.put((*scope, sql_fingerprint(sql)), value)
+
+
+def dedup_call(scope, sql, compute):
+    value = dedup_lookup(scope, sql)
+    if value is None:
+        value = compute()
+        dedup_store(scope, sql, value)
+    return value
+
+
+def enable_sql_dedup(max_entries = SQL_DEDUP.max_entries):
+    global _sql_dedup
+    if _sql_dedup is None:
+        _sql_dedup = CanonicalMemo(max_entries)
+        logging.info("SQL 规范化去重已启用")
+    return _sql_dedup
+
+
+def get_sql_dedup():
+    return _sql_dedup
+
+
+def log_sql_dedup_stats():
+    if _sql_dedup is not None:
+        logging.info(f"SQL 规范化去重统计: {_sql_dedup.stats()}")
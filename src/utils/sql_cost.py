@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import logging
+import threading
+import sqlglot
+from sqlglot import exp
+from config import SQL_COST
+from utils.db_pool import get_db_pool
+from utils.exec_cache import db_snapshot
+
+# 执行前的 EXPLAIN QUERY PLAN 代价闸门：
+#   - 按计划中的 SCAN / SEARCH 顺序模拟嵌套循环，结合预先统计的表行数估算访问的行数；
+#   - 估算代价超过 reject_cost 直接拒绝，超过 warn_cost 则用更短的超时执行；
+#   - 拒绝或超时时把计划摘要作为错误信息返回，修复阶段的 LLM 能看到是哪一步全表扫描。
+
+
+class TableStats:
+    """
+    各数据库每张表的行数，按数据库快照持久化到 JSON，只在第一次用到时统计
+    """
+    def __init__(self, path = SQL_COST.stats_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding = "utf-8") as f:
+                self._stats = json.load(f)
+
+    def get(self, db_path, conn):
+        snapshot = db_snapshot(db_path)
+        with self._lock:
+            if snapshot in self._stats:
+                return self._stats[snapshot]
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+        counts = {t.lower(): conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+        with self._lock:
+            self._stats[snapshot] = counts
+            dir_name = os.path.dirname(self.path)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok = True)
+            with open(self.path, "w", encoding = "utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii = False, indent = 1)
+        return counts
+
+
+def table_aliases(sql):
+    """
+    计划里的表名是别名（"SCAN T1"），用 sqlglot 还原成真实表名
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read = "sqlite")
+    except Exception:
+        return {}
+    return {t.alias_or_name.lower(): t.name.lower() for t in tree.find_all(exp.Table)}
+
+
+def estimate_cost(plan, cardinalities, aliases = None):
+    """
+    plan 为 EXPLAIN QUERY PLAN 的 (id, parent, notused, detail) 行；返回 (估算代价, 计划摘要行)
+    """
+    aliases = aliases or {}
+    children = {}
+    for node_id, parent, _, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+    lines = []
+
+    def table_rows(detail):
+        # "SCAN t" / "SEARCH t USING ..." / "SCAN t AS x"，子查询与 CTE 的行数未知时取默认值
+        name = detail.split()[1].strip('"`[]').lower() if len(detail.split()) > 1 else ""
+        if name == "constant":
+            return 1
+        return cardinalities.get(aliases.get(name, name), SQL_COST.default_rows)
+
+    def walk(parent, outer, depth):
+        loop = outer
+        total = 0.0
+        for node_id, detail in children.get(parent, []):
+            if detail.startswith("SCAN ") or detail.startswith("SEARCH "):
+                card = table_rows(detail)
+                if detail.startswith("SCAN "):
+                    rows = card
+                elif "PRIMARY KEY" in detail or "rowid=" in detail:
+                    rows = 1
+                else:
+                    rows = max(1.0, math.log2(card + 1))
+                if "AUTOMATIC" in detail:
+                    # 自动索引需要先扫描整张表建索引
+                    total += card * max(1.0, math.log2(card + 1))
+                loop *= rows
+                total += loop
+                lines.append(f"{'  ' * depth}{detail} [rows≈{rows:.0f}, loops≈{loop:.2g}]")
+            elif detail.startswith("USE TEMP B-TREE"):
+                total += loop * max(1.0, math.log2(loop + 1))
+                lines.append(f"{'  ' * depth}{detail}")
+            else:
+                lines.append(f"{'  ' * depth}{detail}")
+                # 相关子查询对外层的每一行都执行一次，其余子查询只执行一次
+                total += walk(node_id, loop if detail.startswith("CORRELATED") else 1, depth + 1)
+        return total
+
+    return walk(0, 1, 0), lines
+
+
+class CostGate:
+    def __init__(self,
+                 warn_cost = SQL_COST.warn_cost,
+                 reject_cost = SQL_COST.reject_cost,
+                 tight_timeout = SQL_COST.tight_timeout):
+        self.warn_cost = warn_cost
+        self.reject_cost = reject_cost
+        self.tight_timeout = tight_timeout
+        self.table_stats = TableStats()
+
+        self.checked = 0
+        self.tightened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def check(self, db_path, sql, timeout):
+        """
+        返回 {"decision": run / tighten / reject, "timeout": 实际使用的超时, "cost": 估算代价, "plan": 计划摘要}
+        """
+        try:
+            with get_db_pool().connection(db_path) as conn:
+                cardinalities = self.table_stats.get(db_path, conn)
+                plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+        except Exception:
+            # 无法生成计划（通常是语法错误），交给真正的执行返回错误信息
+            return {"decision": "run", "timeout": timeout, "cost": None, "plan": ""}
+
+        cost, lines = estimate_cost(plan, cardinalities, table_aliases(sql))
+        verdict = {"decision": "run", "timeout": timeout, "cost": cost, "plan": "\n".join(lines)}
+        if cost > self.reject_cost:
+            verdict["decision"] = "reject"
+        elif cost > self.warn_cost and timeout > self.tight_timeout:
+            verdict["decision"] = "tighten"
+            verdict["timeout"] = self.tight_timeout
+        with self._lock:
+            self.checked += 1
+            if verdict["decision"] == "reject":
+                self.rejected += 1
+            elif verdict["decision"] == "tighten":
+                self.tightened += 1
+        if verdict["decision"] != "run":
+            logging.info(f"SQL 代价估算 {cost:.2e}，{verdict['decision']}: {sql}")
+        return verdict
+
+    def stats(self):
+        with self._lock:
+            return {"checked": self.checked, "tightened": self.tightened, "rejected": self.rejected}
+
+
+_cost_gate = None
+
+
+def enable_cost_gate():
+    global _cost_gate
+    if _cost_gate is None:
+        _cost_gate = CostGate()
+        logging.info("SQL 执行前代价闸门已启用")
+    return _cost_gate
+
+
+def get_cost_gate():
+    return _cost_gate
+
+
+def log_cost_gate_stats():
+    if _cost_gate is not None:
+        logging.info(f"SQL 代价闸门统计: {_cost_gate.stats()}")
@@ -0,0 +1,165 @@
+import time
+import queue
+import logging
+import resource
+import threading
+import multiprocessing as mp
+from config import SQL_EXECUTOR
+from utils.db_pool import clear_replicas
+from utils.exec_cache import make_result
+
+# 多进程沙箱 SQL 执行器：
+#   - 预先启动一组常驻 worker 进程，每个 worker 内部复用自己的只读连接池（连接保持温热）；
+#   - worker 设置 RLIMIT_AS 限制内存，每条 SQL 前把 RLIMIT_CPU 软上限设为"已用 CPU + cpu_limit"；
+#     fork 出的 worker 继承父进程的整个地址空间（内存副本、连接池 mmap、LLM 结果），
+#     RLIMIT_AS 设为"worker 启动时的地址空间 + memory_limit"，memory_limit 是 worker 可新增的内存；
+#   - 失控的查询只会让单个 worker 被 OOM / SIGXCPU 杀掉，主进程（持有大量 LLM 结果）不受影响，
+#     执行器返回错误并重新拉起该 worker。
+# 返回值与 utils.util.execute_sql_detail 相同。
+
+
+def address_space_size():
+    """
+    当前进程的虚拟地址空间大小（字节），即 RLIMIT_AS 限制的量；无法读取 /proc 时返回 0
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _worker_main(conn, memory_limit):
+    # 延迟导入，避免与 utils.util 循环依赖
+    import utils.util as util
+    # fork 出的 worker 继承了父进程的执行器，必须在本进程内直接执行
+    disable_sql_executor()
+    # 父进程的内存副本连接不能跨 fork 使用，worker 改回读磁盘文件
+    clear_replicas(memory_only = True)
+    if memory_limit:
+        hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+        soft = address_space_size() + memory_limit
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        sql, db_name, timeout, cpu_limit = task
+        if cpu_limit:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = int(usage.ru_utime + usage.ru_stime) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_limit, resource.getrlimit(resource.RLIMIT_CPU)[1]))
+        try:
+            result = util.execute_sql_detail(sql, db_name, timeout)
+        except MemoryError:
+            result = make_result(0, 0, "Error: SQL worker ran out of memory", 0)
+        conn.send(result)
+
+
+class SQLWorker:
+    def __init__(self, ctx, memory_limit):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target = _worker_main, args = (child_conn, memory_limit), daemon = True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxedSQLExecutor:
+    def __init__(self,
+                 num_workers = SQL_EXECUTOR.num_workers,
+                 memory_limit = SQL_EXECUTOR.memory_limit,
+                 cpu_limit = SQL_EXECUTOR.cpu_limit,
+                 grace = SQL_EXECUTOR.grace):
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.grace = grace
+
+        self.executed = 0
+        self.crashed = 0
+        self.killed = 0
+        self._lock = threading.Lock()
+        self._ctx = mp.get_context()
+        self._idle = queue.Queue()
+        for _ in range(num_workers):
+            self._idle.put(SQLWorker(self._ctx, memory_limit))
+
+    def execute(self, sql, db_name, timeout = 60):
+        worker = self._idle.get()
+        start_time = time.time()
+        try:
+            worker.conn.send((sql, db_name, timeout, self.cpu_limit))
+            # worker 内部用 progress_handler 处理超时，这里再留 grace 秒作为兜底
+            if worker.conn.poll(timeout + self.grace):
+                result = worker.conn.recv()
+                with self._lock:
+                    self.executed += 1
+                return result
+            # worker 没能按时返回（卡在 SQLite 之外），直接杀掉
+            worker.kill()
+            with self._lock:
+                self.killed += 1
+            return make_result(0, 0, "TimeoutError: The SQL query took too long to execute. Please optimize your SQL query.", time.time() - start_time)
+        except (EOFError, OSError):
+            worker.kill()
+            with self._lock:
+                self.crashed += 1
+            logging.warning(f"SQL worker 异常退出(exitcode={worker.process.exitcode})，数据库: {db_name}, SQL: {sql}")
+            return make_result(0, 0, f"Error: SQL execution crashed the worker (exit code {worker.process.exitcode}), the query likely exceeded memory or CPU limits", time.time() - start_time)
+        finally:
+            if not worker.process.is_alive():
+                worker = SQLWorker(self._ctx, self.memory_limit)
+            self._idle.put(worker)
+
+    def close(self):
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout = 1)
+            if worker.process.is_alive():
+                worker.kill()
+
+    def stats(self):
+        with self._lock:
+            return {"executed": self.executed, "crashed": self.crashed, "killed": self.killed}
+
+
+_sql_executor = None
+
+
+def enable_sql_executor(num_workers = SQL_EXECUTOR.num_workers):
+    """
+    需在启动线程池之前调用，worker 进程 fork 自当前进程
+    """
+    global _sql_executor
+    if _sql_executor is None:
+        _sql_executor = SandboxedSQLExecutor(num_workers)
+        logging.info(f"SQL 沙箱执行器已启用: {num_workers} 个 worker 进程")
+    return _sql_executor
+
+
+def disable_sql_executor():
+    global _sql_executor
+    _sql_executor = None
+
+
+def get_sql_executor():
+    return _sql_executor
+
+
+def log_sql_executor_stats():
+    if _sql_executor is not None:
+        logging.info(f"SQL 沙箱执行器统计: {_sql_executor.stats()}")
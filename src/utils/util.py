@@ -1,49 +1,73 @@
 import pandas as pd
 import sqlite3
-import threading
 import os
 import sqlglot
 import time
 from config import DEV
-
-def execute_sql_threaded(sql, db_name, result_container):
-    db_path = f'{DEV.dev_databases_path}/{db_name}/{db_name}.sqlite'
-    conn = None
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(sql)
-        results = cursor.fetchall()
-        result_container['row_count'] = len(results)
-        result_container['column_count'] = len(results[0]) if results else 0
-        result_container['result_preview'] = str(results[:5])
-
-    except Exception as e:
-        result_container['error'] = str(e)
-
-    finally:
-        if conn:
-            conn.close()
+from utils.db_pool import get_db_pool, get_db_path, sql_deadline
+from utils.exec_cache import get_exec_cache, stream_entry, make_error_entry, make_result
+from utils.sql_executor import get_sql_executor
+from utils.sql_cost import get_cost_gate
 
 def execute_sql(sql, db_name, timeout = 60):
-    result_container = {}
-    thread = threading.Thread(target = execute_sql_threaded, args=(sql, db_name, result_container))
-
+    detail = execute_sql_detail(sql, db_name, timeout)
+    return detail["row_count"], detail["column_count"], detail["result"], detail["exec_time"]
+
+
+def execute_sql_detail(sql, db_name, timeout = 60):
+    """
+    返回 {"row_count", "column_count", "result": 预览或错误信息, "exec_time", "fingerprint"}；
+    fingerprint 为与顺序无关的结果指纹，出错、超时或结果被截断时为 None
+    """
+    # 启用沙箱执行器时交给 worker 进程执行，失控的查询不会拖垮当前进程
+    executor = get_sql_executor()
+    if executor is not None:
+        return executor.execute(sql, db_name, timeout)
+
+    db_path = get_db_path(db_name)
+    cache = get_exec_cache()
+    entry = cache.get(db_path, sql) if cache is not None else None
+    if entry is None:
+        start_time = time.time()
+        gate = get_cost_gate()
+        verdict = gate.check(db_path, sql, timeout) if gate is not None else None
+        if verdict is not None and verdict["decision"] == "reject":
+            return make_result(0, 0, f"Error: The SQL query was rejected before execution, its estimated cost ({verdict['cost']:.2e} row visits) is far too high. Query plan:\n{verdict['plan']}", time.time() - start_time)
+        if verdict is not None:
+            timeout = verdict["timeout"]
+
+        entry = execute_sql_uncached(sql, db_path, timeout)
+        # 超时与否取决于本次的时间预算，不写入缓存
+        if cache is not None and entry is not None:
+            cache.put(db_path, sql, entry)
+        if entry is None:
+            message = "TimeoutError: The SQL query took too long to execute. Please optimize your SQL query."
+            if verdict is not None and verdict["plan"]:
+                message += f" Query plan:\n{verdict['plan']}"
+            return make_result(0, 0, message, time.time() - start_time)
+
+    # 返回结果
+    if entry["error"] is not None:
+        return make_result(0, 0, "Error:" + entry["error"], entry["exec_time"])
+    return make_result(entry["row_count"], entry["column_count"], entry["preview"], entry["exec_time"], entry["fingerprint"])
+
+
+def execute_sql_uncached(sql, db_path, timeout = 60):
+    """
+    在调用线程内执行，超时由 progress_handler 中止查询；返回缓存条目，超时返回 None
+    """
     start_time = time.time()
-    thread.start()
-    thread.join(timeout)
-    end_time = time.time()
-    exec_time = end_time - start_time
-
-    if thread.is_alive():
-        # 超时处理
-        return 0, 0, "TimeoutError: The SQL query took too long to execute. Please optimize your SQL query.", exec_time
-    else:
-        # 返回结果
-        if 'error' in result_container:
-            return 0, 0, "Error:" + result_container['error'], exec_time
-        return result_container.get('row_count', 0), result_container.get('column_count', 0), result_container.get('result_preview', ""), exec_time
+    state = {"expired": False}
+    try:
+        with get_db_pool().connection(db_path) as conn, sql_deadline(conn, timeout) as state:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            # 流式读取，超大结果集不会整体载入内存
+            return stream_entry(cursor, start_time)
+    except Exception as e:
+        if state["expired"]:
+            return None
+        return make_error_entry(str(e), time.time() - start_time)
 
 
 def simple_throw_row_data(db_name,tables,table_list):
@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from utils.sql_canonical import canonicalize_sql, sql_fingerprint, dedupe_candidates
+
+
+def test_quoted_tokens_keep_case():
+    # 找不到同名列时 SQLite 把双引号内容当作字符串，"Paris" 与 "PARIS" 的结果不同
+    paris = 'SELECT * FROM city WHERE name = "Paris"'
+    upper = 'SELECT * FROM city WHERE name = "PARIS"'
+    assert canonicalize_sql(paris) != canonicalize_sql(upper)
+    assert sql_fingerprint(paris) != sql_fingerprint(upper)
+    assert dedupe_candidates([paris, upper]) == [paris, upper]
+
+
+def test_unquoted_identifiers_fold_case():
+    assert canonicalize_sql("SELECT Name FROM City") == canonicalize_sql("select name from city")
+
+
+def test_aliases_and_inner_join():
+    a = "SELECT T1.name FROM city AS T1 INNER JOIN country AS T2 ON T1.cid = T2.id"
+    b = "SELECT c.name FROM city c JOIN country k ON c.cid = k.id"
+    assert sql_fingerprint(a) == sql_fingerprint(b)
+
+
+def test_derived_table_alias_does_not_collide():
+    # 子查询别名也参与重命名，T1.a 与 T2.a 不能被规范化成同一个限定名
+    a = "SELECT T1.a FROM (SELECT a, id FROM x) AS T1 JOIN y AS T2 ON T1.id = T2.id"
+    b = "SELECT T2.a FROM (SELECT a, id FROM x) AS T1 JOIN y AS T2 ON T1.id = T2.id"
+    assert sql_fingerprint(a) != sql_fingerprint(b)
+    assert dedupe_candidates([a, b]) == [a, b]
+
+
+def test_cte_names_are_renamed():
+    a = "WITH top AS (SELECT id FROM x) SELECT top.id FROM top"
+    b = "WITH best AS (SELECT id FROM x) SELECT best.id FROM best"
+    assert sql_fingerprint(a) == sql_fingerprint(b)
+    # CTE 重命名后不能与真实表名 c1 冲突
+    c = "WITH top AS (SELECT id FROM c1) SELECT id FROM top"
+    assert '"c1" AS "t' in canonicalize_sql(c) and 'WITH "c2"' in canonicalize_sql(c)